@@ -0,0 +1,22 @@
+import logging
+from datetime import datetime
+import os
+import sys
+
+from common.wp_sync import run_sync
+
+# Настройка логирования
+log_directory = "/home/ubuntu/scripts/mia/log/"
+if not os.path.exists(log_directory):
+    os.makedirs(log_directory)
+
+logging.basicConfig(
+    filename=os.path.join(log_directory, f"2-wp_sync_all_{datetime.now().strftime('%Y-%m-%d')}.log"),
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+# Выгрузка очередей новостей и блога за один проход; одновременный запуск
+# с другой точки входа пропускается (блокировка WP_SYNC_LOCK_PATH в run_sync)
+if __name__ == "__main__":
+    run_sync(['news', 'blog'], update_changed='--update' in sys.argv[1:])
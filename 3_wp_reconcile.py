@@ -0,0 +1,26 @@
+import logging
+from datetime import datetime
+import os
+import sys
+
+from common.wp_reconcile import run_reconcile
+
+# Настройка логирования
+log_directory = "/home/ubuntu/scripts/mia/log/"
+if not os.path.exists(log_directory):
+    os.makedirs(log_directory)
+
+logging.basicConfig(
+    filename=os.path.join(log_directory, f"3-wp_reconcile_{datetime.now().strftime('%Y-%m-%d')}.log"),
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+# Сверка таблицы posts с сайтом. С ключом --repair однозначные расхождения исправляются
+if __name__ == "__main__":
+    report = run_reconcile(repair='--repair' in sys.argv[1:])
+    if report is None:
+        print("Сверка не выполнена, подробности в логе.")
+    else:
+        for key, rows in report.items():
+            print(f"{key}: {len(rows)}")
@@ -0,0 +1,158 @@
+import re
+import html
+import json
+from urllib.parse import unquote
+from html.parser import HTMLParser
+
+# Атрибут src внутри текста одного тега <img>: в кавычках или без них
+img_src_attr_pattern = re.compile(r'''(\ssrc\s*=\s*)(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.IGNORECASE)
+
+class ImgTagScanner(HTMLParser):
+    """Токенизатор, запоминающий только позиции и исходный текст тегов <img>."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.img_tags = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'img':
+            self.img_tags.append((self.getpos(), self.get_starttag_text()))
+
+def rewrite_img_tag(tag_text, resolve):
+    match = img_src_attr_pattern.search(tag_text)
+    if not match:
+        return tag_text
+    src = html.unescape(next(value for value in match.groups()[1:] if value is not None))
+    new_src = resolve(src)
+    if not new_src or new_src == src:
+        return tag_text
+    return f'{tag_text[:match.start()]}{match.group(1)}"{html.escape(new_src)}"{tag_text[match.end():]}'
+
+def rewrite_img_sources(html_text, resolve):
+    """
+    Заменяет src у тегов <img> за один линейный проход токенизатора: остальной HTML
+    не разбирается в дерево и копируется срезами исходной строки. resolve(url) возвращает
+    новый URL или None, если src нужно оставить.
+    """
+    if '<img' not in html_text.lower():
+        return html_text
+
+    scanner = ImgTagScanner()
+    scanner.feed(html_text)
+    scanner.close()
+    if not scanner.img_tags:
+        return html_text
+
+    # getpos() возвращает (строка, колонка) — переводим в смещение в строке
+    line_starts = [0]
+    line_starts.extend(match.end() for match in re.finditer('\n', html_text))
+
+    parts = []
+    position = 0
+    for (line, column), tag_text in scanner.img_tags:
+        start = line_starts[line - 1] + column
+        parts.append(html_text[position:start])
+        parts.append(rewrite_img_tag(tag_text, resolve))
+        position = start + len(tag_text)
+    parts.append(html_text[position:])
+    return ''.join(parts)
+
+# Строка HTML с отступом от 4 пробелов или табуляцией: Markdown счел бы ее блоком кода
+indented_html_line_pattern = re.compile(r'^(?: {4,}|\t)[ \t]*(?=</?[A-Za-z!])')
+code_fence_pattern = re.compile(r'^[ \t]*(```|~~~)')
+
+def dedent_html_lines(content):
+    """
+    Убирает отступ у строк, начинающихся с HTML-тега: модель форматирует вставки (партнерские
+    блоки, таблицы) отступами, и без этого они публиковались бы как <pre><code>.
+    Строки внутри огражденных блоков кода не меняются.
+    """
+    lines = content.split('\n')
+    fence = None
+    for number, line in enumerate(lines):
+        match = code_fence_pattern.match(line)
+        if match:
+            if fence is None:
+                fence = match.group(1)
+            elif match.group(1) == fence:
+                fence = None
+        elif fence is None:
+            lines[number] = indented_html_line_pattern.sub('', line)
+    return '\n'.join(lines)
+
+def render_markdown(content, resolve_image):
+    """
+    Преобразует Markdown поста в HTML за один проход. Источники изображений — и Markdown
+    (![alt](url)), и уже встроенных тегов <img> — передаются в resolve_image(url) во время
+    рендеринга; если он вернул новый URL, src заменяется на него. Mistune кодирует не-ASCII
+    символы URL Markdown-картинок (%D1%80...), поэтому resolve_image получает и
+    раскодированный URL, как он записан в тексте и в post_images.
+
+    Returns:
+        tuple: (HTML, список URL изображений в порядке появления в тексте)
+    """
+    import mistune
+
+    image_refs = []
+
+    def resolve(url):
+        for candidate in dict.fromkeys((url, unquote(url))):
+            new_url = resolve_image(candidate)
+            if new_url:
+                image_refs.append(candidate)
+                return new_url
+        image_refs.append(url)
+        return url
+
+    class MediaRenderer(mistune.HTMLRenderer):
+        def image(self, text, url, title=None):
+            return super().image(text, resolve(url), title)
+
+        def block_html(self, html):
+            return super().block_html(rewrite_img_sources(html, resolve))
+
+        def inline_html(self, html):
+            return super().inline_html(rewrite_img_sources(html, resolve))
+
+    # escape=False: HTML, который модель вставляет в текст, передается в WordPress как есть
+    markdown = mistune.create_markdown(renderer=MediaRenderer(escape=False), plugins=['strikethrough', 'table'])
+    return markdown(dedent_html_lines(content)), image_refs
+
+# Длина description в JSON-LD
+structured_data_description_length = 200
+
+structured_data_author = {"@type": "Person", "name": "Mia Johnson-Carter"}
+
+def plain_text_excerpt(content, max_length=structured_data_description_length):
+    """Текст без HTML и Markdown-разметки, обрезанный по границе слова."""
+    text = re.sub(r'<[^>]+>', ' ', content or '')
+    text = re.sub(r'!\[[^\]]*\]\([^)]*\)', ' ', text)
+    text = re.sub(r'\[([^\]]*)\]\([^)]*\)', r'\1', text)
+    text = re.sub(r'[#*_`>|~]+', ' ', text)
+    text = ' '.join(html.unescape(text).split())
+    if len(text) <= max_length:
+        return text
+    return text[:max_length].rsplit(' ', 1)[0].rstrip(',;:.-') + '…'
+
+def build_structured_data(schema_type, title, content, description, image_url, date_published, date_modified):
+    """
+    Возвращает <script type="application/ld+json"> для поста: NewsArticle или BlogPosting
+    с коротким текстовым описанием вместо полного текста статьи.
+    """
+    date_published = date_published or date_modified
+
+    structured_data = {
+        "@context": "https://schema.org",
+        "@type": schema_type,
+        "headline": title,
+        "description": plain_text_excerpt(description or content),
+        "author": structured_data_author,
+        "datePublished": date_published.isoformat(),
+        "dateModified": date_modified.isoformat()
+    }
+    if image_url:
+        structured_data["image"] = image_url
+
+    # "</" экранируется, чтобы текст не мог закрыть тег <script>
+    json_ld = json.dumps(structured_data, ensure_ascii=False).replace('</', '<\\/')
+    return f'<script type="application/ld+json">{json_ld}</script>'
@@ -0,0 +1,149 @@
+import os
+import re
+from collections import deque
+
+# Параметры перелинковки
+cross_link_config = {
+    # Не больше стольких ссылок на пост
+    'max_links': int(os.getenv('CROSS_LINK_MAX_LINKS', 5)),
+    # Фразы короче этого не индексируются: короткие ключевые фразы дают случайные совпадения
+    'min_phrase_length': 4
+}
+
+# Участки текста, внутри которых ссылки не ставятся: существующие ссылки, HTML-теги,
+# Markdown-ссылки и изображения, блоки кода
+protected_pattern = re.compile(
+    r'<a\b[^>]*>.*?</a\s*>|<[^>]+>|!?\[[^\]]*\]\([^)]*\)|```.*?```|`[^`\n]*`',
+    re.IGNORECASE | re.DOTALL
+)
+
+def create_link_index():
+    """
+    Создает автомат Ахо-Корасик для перелинковки: бор фраз (заголовки и ключевые фразы
+    опубликованных постов), суффиксные ссылки и URL для каждой конечной вершины.
+    """
+    return {
+        # Вершина бора -> {символ: вершина}
+        'goto': [{}],
+        'fail': [0],
+        # Вершина -> (длина фразы, URL), если в ней заканчивается фраза
+        'terminal': [None],
+        # Вершина -> список (длина, URL) всех фраз, оканчивающихся в ней, с учетом суффиксных ссылок
+        'output': [[]],
+        'phrases': {},
+        'built': True
+    }
+
+def add_link_phrase(index, phrase, url):
+    """
+    Добавляет фразу в бор. Суффиксные ссылки пересчитываются лениво — при следующем поиске,
+    поэтому пакет новых постов добавляется за одну перестройку.
+    """
+    phrase = ' '.join((phrase or '').lower().split())
+    if len(phrase) < cross_link_config['min_phrase_length'] or phrase in index['phrases']:
+        return
+    index['phrases'][phrase] = url
+
+    node = 0
+    for char in phrase:
+        next_node = index['goto'][node].get(char)
+        if next_node is None:
+            next_node = len(index['goto'])
+            index['goto'].append({})
+            index['fail'].append(0)
+            index['terminal'].append(None)
+            index['output'].append([])
+            index['goto'][node][char] = next_node
+        node = next_node
+    index['terminal'][node] = (len(phrase), url)
+    index['built'] = False
+
+def build_link_index(index):
+    """Вычисляет суффиксные ссылки и выходы обходом бора в ширину."""
+    goto, fail, terminal, output = index['goto'], index['fail'], index['terminal'], index['output']
+    output[0] = []
+    queue = deque()
+    for child in goto[0].values():
+        fail[child] = 0
+        queue.append(child)
+
+    while queue:
+        node = queue.popleft()
+        output[node] = ([terminal[node]] if terminal[node] else []) + output[fail[node]]
+        for char, child in goto[node].items():
+            state = fail[node]
+            while state and char not in goto[state]:
+                state = fail[state]
+            fail[child] = goto[state].get(char, 0)
+            queue.append(child)
+    index['built'] = True
+
+def find_phrase_matches(index, text):
+    """Возвращает все вхождения фраз как (начало, конец, URL) за один проход по тексту."""
+    if not index['built']:
+        build_link_index(index)
+    goto, fail, output = index['goto'], index['fail'], index['output']
+
+    matches = []
+    node = 0
+    for position, char in enumerate(text):
+        while node and char not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(char, 0)
+        for length, url in output[node]:
+            matches.append((position + 1 - length, position + 1, url))
+    return matches
+
+def is_word_char(char):
+    return char.isalnum() or char == '_'
+
+def insert_cross_links(index, content, exclude_urls=(), max_links=None):
+    """
+    Ставит ссылки на опубликованные посты за один проход автомата: среди пересекающихся
+    совпадений выбирается самое левое и самое длинное, фраза должна стоять на границах слов,
+    на каждый URL — не больше одной ссылки, всего — не больше max_links.
+    """
+    max_links = cross_link_config['max_links'] if max_links is None else max_links
+    if not content or not index['phrases'] or max_links <= 0:
+        return content
+
+    # Поиск без учета регистра; если lower() меняет длину строки, позиции не совпадут,
+    # и такой текст сравнивается как есть
+    lowered = content.lower()
+    text = lowered if len(lowered) == len(content) else content
+
+    # Защищенные участки в порядке следования; совпадения, задевающие их, пропускаются
+    protected = [(match.start(), match.end()) for match in protected_pattern.finditer(content)]
+
+    candidates = sorted(find_phrase_matches(index, text), key=lambda match: (match[0], match[0] - match[1]))
+
+    used_urls = set(exclude_urls)
+    links = []
+    last_end = 0
+    span_index = 0
+    for start, end, url in candidates:
+        if len(links) >= max_links:
+            break
+        if start < last_end or url in used_urls:
+            continue
+        if (start > 0 and is_word_char(content[start - 1])) or (end < len(content) and is_word_char(content[end])):
+            continue
+        while span_index < len(protected) and protected[span_index][1] <= start:
+            span_index += 1
+        if span_index < len(protected) and protected[span_index][0] < end:
+            continue
+        links.append((start, end, url))
+        used_urls.add(url)
+        last_end = end
+
+    if not links:
+        return content
+
+    parts = []
+    position = 0
+    for start, end, url in links:
+        parts.append(content[position:start])
+        parts.append(f'<a href="{url}">{content[start:end]}</a>')
+        position = end
+    parts.append(content[position:])
+    return ''.join(parts)
@@ -0,0 +1,224 @@
+import re
+import time
+import logging
+import threading
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# Параметры поиска изображений в Pixabay
+image_search_config = {
+    'api_url': 'https://pixabay.com/api/',
+    'per_page': 10,
+    'timeout': 10,
+    # Квота Pixabay: 100 запросов за 60 секунд
+    'rate_limit': 100,
+    'rate_period': 60,
+    'lru_size': 512,
+    'prefetch_workers': 4
+}
+
+image_query_stop_words = {
+    'the', 'and', 'is', 'in', 'to', 'of', 'a', 'an', 'for', 'on', 'with', 'as', 'by', 'at', 'from',
+    'your', 'you', 'how', 'what', 'why', 'are', 'can', 'this', 'that', 'its', 'our', 'best', 'top', 'guide'
+}
+
+# Нормализованный запрос -> список [URL, число использований]; самые старые записи вытесняются
+image_lru = OrderedDict()
+image_lru_lock = threading.Lock()
+
+# Поиски, которые уже выполняются: ключ -> Future. Второй поток с тем же ключом ждет
+# первый, а не отправляет в Pixabay такой же запрос
+image_inflight = {}
+
+# Token bucket под квоту Pixabay, общий для всех потоков
+rate_bucket = {
+    'tokens': float(image_search_config['rate_limit']),
+    'updated_at': time.monotonic()
+}
+rate_bucket_lock = threading.Lock()
+
+def normalize_query(query):
+    """Ключ запроса: значимые слова в нижнем регистре, без повторов, по алфавиту."""
+    words = {word for word in re.findall(r'[a-z0-9]+', (query or '').lower())
+             if len(word) > 2 and word not in image_query_stop_words}
+    return ' '.join(sorted(words))
+
+def acquire_rate_token():
+    """Ждет свободный токен в bucket: не больше rate_limit запросов к Pixabay за rate_period секунд."""
+    refill_rate = image_search_config['rate_limit'] / image_search_config['rate_period']
+    while True:
+        with rate_bucket_lock:
+            now = time.monotonic()
+            rate_bucket['tokens'] = min(
+                image_search_config['rate_limit'],
+                rate_bucket['tokens'] + (now - rate_bucket['updated_at']) * refill_rate
+            )
+            rate_bucket['updated_at'] = now
+            if rate_bucket['tokens'] >= 1:
+                rate_bucket['tokens'] -= 1
+                return
+            wait = (1 - rate_bucket['tokens']) / refill_rate
+        time.sleep(wait)
+
+def ensure_images_columns(conn):
+    """
+    Добавляет в images нормализованный ключ запроса и счетчик использований для ротации
+    и уникальный индекс (query_key, image_url), чтобы одна находка не сохранялась дважды.
+    Как и в wp_sync.ensure_sync_columns, DDL выполняется только для того, чего в базе еще нет:
+    ALTER TABLE и CREATE INDEX берут блокировку images даже с IF NOT EXISTS.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'images' AND column_name IN ('query_key', 'use_count')
+        """)
+        if len(cursor.fetchall()) < 2:
+            cursor.execute("""
+                ALTER TABLE images
+                    ADD COLUMN IF NOT EXISTS query_key text,
+                    ADD COLUMN IF NOT EXISTS use_count integer NOT NULL DEFAULT 0
+            """)
+        cursor.execute("SELECT to_regclass('images_query_key_idx')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("CREATE INDEX IF NOT EXISTS images_query_key_idx ON images (query_key)")
+        cursor.execute("SELECT to_regclass('images_query_key_url_key')")
+        if cursor.fetchone()[0] is None:
+            # Дубли, сохраненные параллельными поисками до появления индекса
+            cursor.execute("""
+                DELETE FROM images a USING images b
+                WHERE a.query_key = b.query_key AND a.image_url = b.image_url AND a.ctid > b.ctid
+            """)
+            cursor.execute("CREATE UNIQUE INDEX images_query_key_url_key ON images (query_key, image_url)")
+    conn.commit()
+
+def lru_get(key):
+    with image_lru_lock:
+        hits = image_lru.get(key)
+        if hits is not None:
+            image_lru.move_to_end(key)
+        return hits
+
+def lru_put(key, hits):
+    with image_lru_lock:
+        image_lru[key] = hits
+        image_lru.move_to_end(key)
+        while len(image_lru) > image_search_config['lru_size']:
+            image_lru.popitem(last=False)
+
+def load_hits_from_db(conn, key, query):
+    # Строки, сохраненные до появления query_key, находятся по точному тексту запроса
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT image_url, use_count FROM images WHERE query_key = %s OR (query_key IS NULL AND query = %s)",
+            (key, query)
+        )
+        return [[image_url, use_count] for image_url, use_count in cursor.fetchall()]
+
+def fetch_hits_from_pixabay(conn, api_key, key, query, source):
+    acquire_rate_token()
+    response = requests.get(
+        image_search_config['api_url'],
+        params={
+            'key': api_key,
+            'q': key or query,
+            'image_type': 'photo',
+            'per_page': image_search_config['per_page'],
+            'safesearch': 'true',
+            'order': 'popular'
+        },
+        timeout=image_search_config['timeout']
+    )
+    if response.status_code != 200:
+        logging.error(f"Ошибка запроса к Pixabay для '{query}': {response.status_code}")
+        return None
+
+    image_urls = [hit['webformatURL'] for hit in response.json().get('hits', [])]
+    if image_urls:
+        with conn.cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO images (query, query_key, image_url, source, timestamp) VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (query_key, image_url) DO NOTHING
+                """,
+                [(query, key, image_url, source) for image_url in image_urls]
+            )
+        conn.commit()
+    return [[image_url, 0] for image_url in image_urls]
+
+def lookup_hits(conn, api_key, query, source='pixabay'):
+    """
+    Найденные изображения запроса: из LRU, затем из таблицы images, затем из Pixabay.
+    Одновременные поиски одного ключа выполняются один раз, остальные потоки ждут результат.
+    """
+    key = normalize_query(query)
+    hits = lru_get(key)
+    if hits is not None:
+        return hits
+
+    with image_lru_lock:
+        # Поиск мог завершиться между проверкой LRU и захватом блокировки
+        if key in image_lru:
+            return image_lru[key]
+        pending = image_inflight.get(key)
+        if pending is None:
+            pending = image_inflight[key] = Future()
+            owner = True
+        else:
+            owner = False
+    if not owner:
+        return pending.result()
+
+    try:
+        hits = load_hits_from_db(conn, key, query)
+        if not hits:
+            hits = fetch_hits_from_pixabay(conn, api_key, key, query, source)
+        if hits is not None:
+            lru_put(key, hits)
+        pending.set_result(hits)
+        return hits
+    except Exception as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with image_lru_lock:
+            image_inflight.pop(key, None)
+
+def get_image_url(query, api_key, conn, source='pixabay'):
+    """
+    Возвращает наименее использованное изображение запроса и увеличивает его счетчик,
+    чтобы посты на похожие темы не получали одну и ту же фотографию.
+    """
+    try:
+        hits = lookup_hits(conn, api_key, query, source)
+        if not hits:
+            logging.debug(f"Изображение для запроса '{query}' не найдено.")
+            return None
+        with image_lru_lock:
+            hit = min(hits, key=lambda item: item[1])
+            hit[1] += 1
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE images SET use_count = use_count + 1 WHERE image_url = %s", (hit[0],))
+        conn.commit()
+        return hit[0]
+    except Exception as e:
+        logging.error(f"Ошибка поиска изображения для '{query}': {e}")
+        conn.rollback()
+        return None
+
+def prefetch_images(queries, api_key, connection_factory, source='pixabay'):
+    """
+    Заранее загружает в LRU изображения для списка запросов, параллельно и в пределах квоты.
+    connection_factory() возвращает контекстный менеджер с подключением к базе.
+    """
+    def prefetch(query):
+        try:
+            with connection_factory() as conn:
+                lookup_hits(conn, api_key, query, source)
+        except Exception as e:
+            logging.error(f"Ошибка предварительного поиска изображения для '{query}': {e}")
+
+    unique_queries = list({normalize_query(query): query for query in queries}.values())
+    with ThreadPoolExecutor(max_workers=image_search_config['prefetch_workers']) as executor:
+        list(executor.map(prefetch, unique_queries))
+    logging.info(f"Предварительно найдены изображения для {len(unique_queries)} запросов.")
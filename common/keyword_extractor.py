@@ -0,0 +1,220 @@
+import re
+import math
+import logging
+import threading
+from collections import Counter
+from psycopg2.extras import execute_values
+
+# Параметры извлечения ключевых слов
+keyword_extractor_config = {
+    'limit': 10,
+    # Биграмма считается устойчивой фразой, если встречается в тексте не реже этого
+    'min_bigram_count': 2,
+    'batch_size': 500
+}
+
+keyword_stop_words = {
+    'the', 'and', 'is', 'in', 'to', 'of', 'a', 'an', 'for', 'on', 'with', 'as', 'by', 'at', 'from',
+    'it', 'its', 'this', 'that', 'these', 'those', 'be', 'are', 'was', 'were', 'been', 'being', 'or',
+    'but', 'not', 'no', 'so', 'if', 'then', 'than', 'too', 'very', 'can', 'will', 'just', 'do', 'does',
+    'did', 'has', 'have', 'had', 'you', 'your', 'yours', 'we', 'our', 'ours', 'they', 'their', 'them',
+    'he', 'she', 'his', 'her', 'him', 'my', 'me', 'i', 'all', 'any', 'each', 'more', 'most', 'other',
+    'some', 'such', 'only', 'own', 'same', 'about', 'into', 'over', 'after', 'before', 'also', 'how',
+    'what', 'when', 'where', 'which', 'who', 'why', 'here', 'there', 'out', 'up', 'down', 'one', 'get',
+    'like', 'make', 'many', 'much', 'well', 'even', 'may', 'might', 'should', 'would', 'could', 'while'
+}
+
+# Разметка, которая не должна попадать в термины: HTML-теги, URL ссылок и изображений, адреса
+markup_pattern = re.compile(r'<[^>]+>|\]\([^)]*\)|https?://\S+|\{\{[^}]*\}\}')
+segment_pattern = re.compile(r'[.!?;:,()\[\]"\n]+')
+word_pattern = re.compile(r"[a-z][a-z0-9'-]*[a-z0-9]")
+
+def create_keyword_model():
+    """
+    Документная частота терминов (слов и биграмм) по всем posts.content в памяти.
+    Таблица keyword_df хранит те же данные между запусками, keyword_corpus — число
+    учтенных документов, флаг posts.keyword_counted — какие посты уже учтены.
+    """
+    return {
+        'df': {},
+        'documents': 0,
+        'loaded': False,
+        'lock': threading.Lock()
+    }
+
+def ensure_keyword_tables(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS keyword_df (
+                term text PRIMARY KEY,
+                df integer NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS keyword_corpus (
+                id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+                documents integer NOT NULL,
+                -- Прежний водяной знак учтенных постов, нужен только при добавлении posts.keyword_counted
+                last_post_id integer NOT NULL
+            )
+        """)
+        cursor.execute("INSERT INTO keyword_corpus (documents, last_post_id) VALUES (0, 0) ON CONFLICT DO NOTHING")
+
+        # Учтенные посты отмечаются флагом, а не наибольшим id: пост, вставленный параллельным
+        # скриптом с меньшим id, чем у уже учтенного, иначе не попал бы в таблицу частот.
+        # ALTER TABLE блокирует posts даже без изменений, поэтому сначала проверяется колонка
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'posts' AND column_name = 'keyword_counted'
+        """)
+        if cursor.fetchone() is None:
+            cursor.execute("ALTER TABLE posts ADD COLUMN IF NOT EXISTS keyword_counted boolean NOT NULL DEFAULT FALSE")
+            # До появления флага учтенными считались посты до keyword_corpus.last_post_id
+            cursor.execute("""
+                UPDATE posts SET keyword_counted = TRUE
+                WHERE id <= (SELECT last_post_id FROM keyword_corpus)
+            """)
+        cursor.execute("SELECT to_regclass('posts_keyword_uncounted_idx')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS posts_keyword_uncounted_idx
+                ON posts (id) WHERE NOT keyword_counted
+            """)
+    conn.commit()
+
+def tokenize_segments(content):
+    """Слова текста по фрагментам между знаками препинания: биграммы не переходят через границу фрагмента."""
+    text = markup_pattern.sub(' ', (content or '').lower())
+    for segment in segment_pattern.split(text):
+        # Притяжательное 's не создает отдельный термин: racket's -> racket
+        words = [word[:-2] if word.endswith("'s") else word for word in word_pattern.findall(segment)]
+        if words:
+            yield words
+
+def count_terms(content):
+    """За один проход считает значимые слова и биграммы из двух значимых слов подряд."""
+    unigrams, bigrams = Counter(), Counter()
+    for words in tokenize_segments(content):
+        previous = None
+        for word in words:
+            if word in keyword_stop_words or len(word) < 3:
+                previous = None
+                continue
+            unigrams[word] += 1
+            # Повтор слова ("tennis tennis") фразой не считается
+            if previous and previous != word:
+                bigrams[f'{previous} {word}'] += 1
+            previous = word
+    return unigrams, bigrams
+
+def document_terms(content):
+    unigrams, bigrams = count_terms(content)
+    return set(unigrams) | set(bigrams)
+
+def record_document(cursor, content, post_id):
+    """
+    Добавляет термины документа в keyword_df и отмечает пост учтенным в транзакции
+    вызывающего кода, вместе с вставкой поста.
+    Строки обновляются в порядке сортировки терминов: параллельные сохранения блокируют общие
+    термины в одном порядке и не попадают во взаимную блокировку.
+    Возвращает термины для apply_document после commit.
+    """
+    terms = document_terms(content)
+    if terms:
+        execute_values(cursor, """
+            INSERT INTO keyword_df (term, df) VALUES %s
+            ON CONFLICT (term) DO UPDATE SET df = keyword_df.df + 1
+        """, [(term, 1) for term in sorted(terms)], page_size=len(terms))
+    cursor.execute("UPDATE posts SET keyword_counted = TRUE WHERE id = %s", (post_id,))
+    cursor.execute("UPDATE keyword_corpus SET documents = documents + 1")
+    return terms
+
+def apply_document(model, terms):
+    with model['lock']:
+        df = model['df']
+        for term in terms:
+            df[term] = df.get(term, 0) + 1
+        model['documents'] += 1
+
+def catch_up(model, conn):
+    """
+    Учитывает посты, еще не отмеченные keyword_counted (в том числе вставленные другими скриптами),
+    пакетами. Пакет отмечается и считается в одной транзакции; строки, которые в это время
+    учитывает другой процесс, пропускаются (SKIP LOCKED), так что пост не учитывается дважды.
+    """
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, content FROM posts
+                WHERE NOT keyword_counted
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (keyword_extractor_config['batch_size'],))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            applied = [record_document(cursor, content, post_id) for post_id, content in rows]
+        conn.commit()
+        for terms in applied:
+            apply_document(model, terms)
+        logging.info(f"Таблица частот терминов: учтено {len(rows)} постов, всего {model['documents']}.")
+
+def load_keyword_model(model, conn):
+    """
+    Учитывает неучтенные посты и загружает таблицу частот в память один раз за запуск.
+    Таблица читается после дочитывания: так в памяти оказываются и пакеты, которые
+    одновременно учли другие процессы.
+    """
+    if model['loaded']:
+        return
+    ensure_keyword_tables(conn)
+    catch_up(model, conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT documents FROM keyword_corpus")
+        documents = cursor.fetchone()[0]
+        cursor.execute("SELECT term, df FROM keyword_df")
+        df = dict(cursor.fetchall())
+    conn.commit()
+    with model['lock']:
+        model['documents'], model['df'] = documents, df
+    model['loaded'] = True
+
+def extract_keywords(model, content, limit=None):
+    """
+    Ключевые слова поста по TF-IDF относительно корпуса. Устойчивые биграммы конкурируют
+    со словами на равных; слово, которое почти не встречается вне устойчивой биграммы,
+    отдельным кандидатом не считается, а слово из выбранной биграммы не повторяется.
+    """
+    limit = limit or keyword_extractor_config['limit']
+    min_count = keyword_extractor_config['min_bigram_count']
+    unigrams, bigrams = count_terms(content)
+    phrases = {bigram: count for bigram, count in bigrams.items() if count >= min_count}
+
+    # Сколько раз слово встречается вне устойчивых биграмм
+    standalone = Counter(unigrams)
+    for bigram, count in phrases.items():
+        for word in bigram.split(' '):
+            standalone[word] -= count
+    candidates = {
+        word: count for word, count in unigrams.items()
+        if count == standalone[word] or standalone[word] >= min_count
+    }
+    candidates.update(phrases)
+
+    with model['lock']:
+        documents, df = model['documents'], model['df']
+        scores = {
+            term: (1 + math.log(count)) * (math.log((1 + documents) / (1 + df.get(term, 0))) + 1)
+            for term, count in candidates.items()
+        }
+
+    keywords, covered = [], set()
+    for term in sorted(scores, key=lambda term: (-scores[term], term)):
+        if term in covered:
+            continue
+        keywords.append(term)
+        covered.update(term.split(' '))
+        if len(keywords) >= limit:
+            break
+    return keywords
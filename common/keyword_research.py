@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import time
+import string
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# Параметры подбора ключевых слов через Google Suggest
+keyword_config = {
+    'suggest_url': 'http://suggestqueries.google.com/complete/search',
+    # Кэш подсказок на диске: {seed: {'fetched_at': unix time, 'keywords': [...]}}
+    'cache_path': os.getenv('KEYWORD_CACHE_PATH', '/home/ubuntu/scripts/mia/.keyword_cache.json'),
+    'ttl': int(os.getenv('KEYWORD_CACHE_TTL', 7 * 24 * 3600)),
+    'timeout': 5,
+    'workers': 8,
+    # Общий для всех потоков лимит запросов к Google Suggest в секунду
+    'rate_limit': float(os.getenv('KEYWORD_RATE_LIMIT', 5)),
+    'max_keywords': 20,
+    'question_words': ['how', 'what', 'why', 'when', 'which', 'best', 'can', 'is']
+}
+
+# Кэш в памяти поверх дискового: в течение запуска запрос к Suggest для seed выполняется не больше одного раза
+keyword_cache = {}
+keyword_cache_lock = threading.Lock()
+keyword_cache_loaded = False
+
+# Результаты за текущий запуск, включая пустые и неполные: seed -> ключевые слова.
+# Per-seed блокировки не дают двум потокам одновременно опрашивать Suggest по одному seed
+run_results = {}
+seed_locks = {}
+
+# Время, раньше которого нельзя отправить следующий запрос к Suggest
+rate_state = {'next_at': 0.0}
+rate_lock = threading.Lock()
+
+def normalize_keyword(keyword):
+    return ' '.join((keyword or '').lower().split())
+
+def load_keyword_cache():
+    global keyword_cache_loaded
+    if keyword_cache_loaded:
+        return
+    keyword_cache_loaded = True
+    try:
+        with open(keyword_config['cache_path'], 'r', encoding='utf-8') as f:
+            keyword_cache.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"Ошибка при чтении кэша ключевых слов {keyword_config['cache_path']}: {e}")
+
+def save_keyword_cache():
+    # Пишем во временный файл и атомарно подменяем кэш
+    path = keyword_config['cache_path']
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(keyword_cache, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Не удалось сохранить кэш ключевых слов {path}: {e}")
+
+def wait_rate_slot():
+    """Равномерно распределяет запросы всех потоков: не больше rate_limit в секунду."""
+    with rate_lock:
+        now = time.monotonic()
+        slot = max(now, rate_state['next_at'])
+        rate_state['next_at'] = slot + 1 / keyword_config['rate_limit']
+    if slot > now:
+        time.sleep(slot - now)
+
+def fetch_suggestions(session, query):
+    """Подсказки Google Suggest для одного запроса; при ошибке — None."""
+    wait_rate_slot()
+    try:
+        response = session.get(
+            keyword_config['suggest_url'],
+            params={'client': 'firefox', 'q': query, 'hl': 'en'},
+            headers={'User-Agent': 'Mozilla/5.0'},
+            timeout=keyword_config['timeout']
+        )
+        if response.status_code == 200:
+            return response.json()[1]
+        logging.error(f"Google Suggest вернул {response.status_code} для запроса '{query}'")
+    except Exception as e:
+        logging.error(f"Ошибка при запросе подсказок для '{query}': {e}")
+    return None
+
+def expansion_queries(seed):
+    """Исходный запрос, запрос с каждой буквой алфавита и запросы с вопросительными словами."""
+    return ([seed] + [f"{seed} {letter}" for letter in string.ascii_lowercase]
+            + [f"{word} {seed}" for word in keyword_config['question_words']])
+
+def rank_suggestions(seed, results):
+    """
+    Объединяет подсказки всех запросов: повторы схлопываются, ключ получает тем больше очков,
+    чем выше он в выдаче и чем в большем числе запросов встречается. Подсказки исходного
+    запроса весят вдвое больше.
+    """
+    seed_key = normalize_keyword(seed)
+    scores, labels = {}, {}
+    for query_index, suggestions in enumerate(results):
+        weight = 2.0 if query_index == 0 else 1.0
+        for rank, suggestion in enumerate(suggestions):
+            key = normalize_keyword(suggestion)
+            if not key or key == seed_key or not re.search(r'[a-z]', key):
+                continue
+            scores[key] = scores.get(key, 0.0) + weight * (len(suggestions) - rank) / len(suggestions)
+            labels.setdefault(key, suggestion.strip())
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [labels[key] for key in ranked[:keyword_config['max_keywords']]]
+
+def research_keywords(seed):
+    """
+    Ключевые слова для seed: из результатов текущего запуска, из дискового кэша, если он
+    моложе ttl, иначе параллельный опрос Google Suggest по всем вариантам запроса
+    с ранжированием объединенной выдачи. За запуск Suggest опрашивается по seed не больше раза.
+    """
+    cache_key = normalize_keyword(seed)
+    with keyword_cache_lock:
+        seed_lock = seed_locks.setdefault(cache_key, threading.Lock())
+
+    with seed_lock:
+        if cache_key in run_results:
+            return run_results[cache_key]
+
+        with keyword_cache_lock:
+            load_keyword_cache()
+            cached = keyword_cache.get(cache_key)
+        if cached and time.time() - cached['fetched_at'] < keyword_config['ttl']:
+            run_results[cache_key] = cached['keywords']
+            return cached['keywords']
+
+        with requests.Session() as session, ThreadPoolExecutor(max_workers=keyword_config['workers']) as executor:
+            results = list(executor.map(lambda query: fetch_suggestions(session, query), expansion_queries(seed)))
+        failed = sum(1 for suggestions in results if suggestions is None)
+        keywords = rank_suggestions(seed, [suggestions or [] for suggestions in results])
+        logging.debug(f"Подобрано {len(keywords)} ключевых слов для '{seed}' по {len(results)} запросам, ошибок: {failed}.")
+
+        run_results[cache_key] = keywords
+        # На диск попадает только полная выдача: пустой или неполный результат живет до конца запуска
+        if keywords and not failed:
+            with keyword_cache_lock:
+                keyword_cache[cache_key] = {'fetched_at': time.time(), 'keywords': keywords}
+                save_keyword_cache()
+        return keywords
@@ -0,0 +1,369 @@
+import os
+import json
+import math
+import fcntl
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+# Маршруты генерации: модели-кандидаты в порядке стоимости (сначала дешевые) и границы max_tokens.
+# Выбирается первая модель, чей p95 задержки укладывается в latency_budget; max_tokens берется
+# из p95 длины ответа маршрута с запасом token_headroom.
+llm_routes = {
+    'theme_ideas': {
+        'models': ['llama-3.1-sonar-small-128k-online', 'llama-3.1-sonar-large-128k-online'],
+        'latency_budget': 30,
+        'max_tokens': 500,
+        'min_tokens': 300,
+        'max_tokens_cap': 1000
+    },
+    'blog_article': {
+        'models': ['llama-3.1-sonar-small-128k-online', 'llama-3.1-sonar-large-128k-online'],
+        'latency_budget': 90,
+        'max_tokens': 2500,
+        'min_tokens': 1200,
+        'max_tokens_cap': 4000
+    },
+    'news_article': {
+        'models': ['llama-3.1-sonar-small-128k-online', 'llama-3.1-sonar-large-128k-online'],
+        'latency_budget': 90,
+        'max_tokens': 2500,
+        'min_tokens': 1200,
+        'max_tokens_cap': 4000
+    }
+}
+
+llm_config = {
+    'api_url': 'https://api.perplexity.ai/chat/completions',
+    # Статистика вызовов на диске: {маршрут: {модель: {'latency': [...], 'tokens': [...]}}}
+    'stats_path': os.getenv('LLM_STATS_PATH', '/home/ubuntu/scripts/mia/.llm_stats.json'),
+    'window': 200,
+    # Пока выборка меньше, используются значения маршрута по умолчанию
+    'min_samples': 10,
+    # Выбор модели смотрит только на последние вызовы, чтобы старые задержки не решали навсегда
+    'recent_samples': 20,
+    # Модель дешевле выбранной, вышедшая за бюджет задержки, пробуется снова не реже этого (секунды)
+    'probe_interval': 1800,
+    'token_headroom': 1.25,
+    # (connect, read): ответ, идущий дольше, считается ошибкой
+    'timeout': (10, 300),
+    'chunk_size': 16 * 1024,
+    # Дубликат запроса отправляется, если ответа нет дольше p95 задержки маршрута (не раньше этого)
+    'hedge_min_delay': 5,
+    # После стольких ошибок подряд основной провайдер на failover_cooldown секунд заменяется резервным
+    'failover_after': 3,
+    'failover_cooldown': 600,
+    # Резервный OpenAI-совместимый endpoint: полный URL chat/completions
+    'fallback_url': os.getenv('LLM_FALLBACK_URL'),
+    'fallback_api_key': os.getenv('LLM_FALLBACK_API_KEY'),
+    'fallback_model': os.getenv('LLM_FALLBACK_MODEL'),
+    # Параметры Perplexity (поиск, цитаты) резервному endpoint не передаются
+    'fallback_params': ('temperature', 'top_p', 'stream', 'presence_penalty', 'frequency_penalty')
+}
+
+llm_stats = {}
+llm_stats_lock = threading.Lock()
+llm_stats_loaded = False
+
+# Вызовы и пробы этого процесса, еще не записанные на диск: при записи они добавляются
+# к файлу, а не заменяют его, и статистика параллельных генераторов не теряется
+llm_pending = {}
+
+# Состояние основного провайдера: ошибки подряд и время, до которого запросы идут на резервный
+provider_state = {
+    'errors': 0,
+    'down_until': 0.0
+}
+provider_state_lock = threading.Lock()
+
+def load_llm_stats():
+    global llm_stats_loaded
+    if llm_stats_loaded:
+        return
+    llm_stats_loaded = True
+    try:
+        with open(llm_config['stats_path'], 'r', encoding='utf-8') as f:
+            llm_stats.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"Ошибка при чтении статистики LLM {llm_config['stats_path']}: {e}")
+
+def save_llm_stats():
+    """
+    Под файловой блокировкой перечитывает статистику с диска, добавляет к ней несохраненные
+    вызовы этого процесса и атомарно подменяет файл. В памяти остается объединенная статистика.
+    Вызывается под llm_stats_lock.
+    """
+    path = llm_config['stats_path']
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(f"{path}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    merged = json.load(f)
+            except FileNotFoundError:
+                merged = {}
+
+            for route, models in llm_pending.items():
+                for model, pending in models.items():
+                    stats = merged.setdefault(route, {}).setdefault(model, {'latency': [], 'tokens': []})
+                    stats['latency'] = (stats['latency'] + pending['latency'])[-llm_config['window']:]
+                    stats['tokens'] = (stats['tokens'] + pending['tokens'])[-llm_config['window']:]
+                    stats['probed_at'] = max(stats.get('probed_at', 0), pending.get('probed_at', 0))
+
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, path)
+        llm_pending.clear()
+        llm_stats.clear()
+        llm_stats.update(merged)
+    except Exception as e:
+        logging.error(f"Не удалось сохранить статистику LLM {path}: {e}")
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+def model_stats(route, model, stats=None):
+    stats = llm_stats if stats is None else stats
+    return stats.setdefault(route, {}).setdefault(model, {'latency': [], 'tokens': []})
+
+def choose_route(route):
+    """
+    Модель и max_tokens для маршрута по накопленной статистике. Решение принимается по
+    последним recent_samples вызовам модели; более дешевая модель, вышедшая за бюджет,
+    раз в probe_interval получает пробный вызов, чтобы ее статистика обновлялась.
+
+    Returns:
+        tuple: (model, max_tokens)
+    """
+    settings = llm_routes[route]
+    with llm_stats_lock:
+        load_llm_stats()
+        observed = {}
+        for model in settings['models']:
+            latencies = model_stats(route, model)['latency'][-llm_config['recent_samples']:]
+            if len(latencies) >= llm_config['min_samples']:
+                observed[model] = percentile(latencies, 0.95)
+
+        # Модель без статистики считается укладывающейся в бюджет; если в бюджет не укладывается
+        # ни одна, берется самая быстрая из наблюдавшихся
+        model = next((model for model in settings['models']
+                      if observed.get(model, 0) <= settings['latency_budget']), None)
+        if model is None:
+            model = min(observed, key=observed.get)
+
+        now = time.time()
+        for candidate in settings['models'][:settings['models'].index(model)]:
+            if now - model_stats(route, candidate).get('probed_at', 0) >= llm_config['probe_interval']:
+                logging.info(f"Пробный вызов модели {candidate} по маршруту '{route}' вместо {model}.")
+                model = candidate
+                model_stats(route, model)['probed_at'] = now
+                model_stats(route, model, llm_pending)['probed_at'] = now
+                break
+
+        tokens = model_stats(route, model)['tokens']
+        if len(tokens) >= llm_config['min_samples']:
+            max_tokens = int(percentile(tokens, 0.95) * llm_config['token_headroom'])
+            max_tokens = max(settings['min_tokens'], min(settings['max_tokens_cap'], max_tokens))
+        else:
+            max_tokens = settings['max_tokens']
+    return model, max_tokens
+
+def record_call(route, model, latency, completion_tokens, truncated=False):
+    """
+    Добавляет вызов в скользящее окно статистики маршрута. Ответ, обрезанный по max_tokens,
+    записывается как вдвое более длинный, чтобы следующий max_tokens вырос.
+    """
+    if truncated:
+        completion_tokens = min(completion_tokens * 2, llm_routes[route]['max_tokens_cap'])
+    with llm_stats_lock:
+        load_llm_stats()
+        pending = model_stats(route, model, llm_pending)
+        pending['latency'].append(round(latency, 3))
+        pending['tokens'].append(completion_tokens)
+        save_llm_stats()
+
+def hedge_delay(route, model):
+    """Через сколько секунд без ответа отправлять дубликат: p95 задержки или бюджет маршрута."""
+    with llm_stats_lock:
+        latencies = model_stats(route, model)['latency']
+        if len(latencies) >= llm_config['min_samples']:
+            delay = percentile(latencies, 0.95)
+        else:
+            delay = llm_routes[route]['latency_budget']
+    return max(llm_config['hedge_min_delay'], delay)
+
+def start_request(url, headers, payload, started_at, abandoned):
+    """
+    Отправляет POST в daemon-потоке: поток проигравшего запроса не задерживает завершение
+    процесса. Тело ответа читается по частям, и после abandoned чтение прерывается, а ответ
+    закрывается. Задержка считается от started_at — момента отправки первого из запросов.
+
+    Returns:
+        tuple: (Future с (response, latency), requests.Session)
+    """
+    future = Future()
+    session = requests.Session()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            response = session.post(url, headers=headers, json=payload, timeout=llm_config['timeout'], stream=True)
+            chunks = []
+            for chunk in response.iter_content(llm_config['chunk_size']):
+                if abandoned.is_set():
+                    response.close()
+                    raise RuntimeError("запрос LLM прерван: победил другой запрос")
+                chunks.append(chunk)
+            # Тело уже прочитано: response.content и response.json() работают как обычно
+            response._content = b''.join(chunks)
+            future.set_result((response, time.monotonic() - started_at))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='llm-request', daemon=True).start()
+    return future, session
+
+def hedged_post(url, headers, payload, delay):
+    """
+    POST с одним дубликатом: если за delay секунд ответа нет, тот же запрос отправляется еще раз
+    и побеждает первый ответ 200. Чтение ответа проигравшего прерывается, его сессия закрывается.
+
+    Returns:
+        tuple: (response, latency от отправки первого запроса). Если ни один запрос
+        не получил ответа, пробрасывается ошибка.
+    """
+    started_at = time.monotonic()
+    abandoned = threading.Event()
+    sessions, futures = [], []
+
+    def launch():
+        future, session = start_request(url, headers, payload, started_at, abandoned)
+        sessions.append(session)
+        futures.append(future)
+
+    launch()
+    result, error = None, None
+    try:
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            logging.info(f"Ответа LLM нет дольше {delay:.1f} с, отправлен дубликат запроса.")
+            launch()
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if result[0].status_code == 200:
+                    return result
+        if result is not None:
+            return result
+        raise error
+    finally:
+        abandoned.set()
+        for session in sessions:
+            session.close()
+
+def fallback_configured():
+    return bool(llm_config['fallback_url'] and llm_config['fallback_model'])
+
+def fallback_active():
+    with provider_state_lock:
+        return fallback_configured() and time.monotonic() < provider_state['down_until']
+
+def note_provider_result(ok):
+    """Учитывает исход запроса к основному провайдеру. Возвращает True, если пора переключиться на резервный."""
+    with provider_state_lock:
+        if ok:
+            provider_state['errors'] = 0
+            return False
+        provider_state['errors'] += 1
+        if provider_state['errors'] < llm_config['failover_after'] or not fallback_configured():
+            return False
+        provider_state['errors'] = 0
+        provider_state['down_until'] = time.monotonic() + llm_config['failover_cooldown']
+    logging.warning(f"Основной провайдер LLM не отвечает, запросы на {llm_config['failover_cooldown']} с "
+                    f"переключены на {llm_config['fallback_url']}.")
+    return True
+
+def fallback_completion(route, messages, max_tokens, params):
+    model = llm_config['fallback_model']
+    payload = {key: value for key, value in params.items() if key in llm_config['fallback_params']}
+    payload.update(model=model, messages=messages, max_tokens=max_tokens)
+    headers = {
+        'Authorization': f"Bearer {llm_config['fallback_api_key']}",
+        'Content-Type': 'application/json'
+    }
+    logging.debug(f"Запрос LLM по маршруту '{route}' к резервному провайдеру: модель {model}, max_tokens {max_tokens}.")
+    response, _ = hedged_post(llm_config['fallback_url'], headers, payload, hedge_delay(route, model))
+    return response
+
+def chat_completion(route, api_key, messages, **params):
+    """
+    Запрос к chat/completions с моделью и max_tokens маршрута route. Остальные параметры
+    payload передаются как есть. Медленный запрос дублируется после p95 задержки маршрута;
+    после failover_after ошибок подряд запросы на время уходят к резервному провайдеру.
+    Успешные ответы пополняют статистику маршрута.
+
+    Returns:
+        requests.Response
+    """
+    model, max_tokens = choose_route(route)
+    if fallback_active():
+        return fallback_completion(route, messages, max_tokens, params)
+
+    payload = dict(params, model=model, messages=messages, max_tokens=max_tokens)
+    headers = {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+    logging.debug(f"Запрос LLM по маршруту '{route}': модель {model}, max_tokens {max_tokens}.")
+
+    try:
+        response, latency = hedged_post(llm_config['api_url'], headers, payload, hedge_delay(route, model))
+    except Exception as e:
+        logging.error(f"Ошибка запроса LLM по маршруту '{route}': {e}")
+        if note_provider_result(False):
+            return fallback_completion(route, messages, max_tokens, params)
+        raise
+
+    # Перегрузка и ошибки сервера — сбой провайдера; ошибки в самом запросе (4xx) — нет
+    if response.status_code == 429 or response.status_code >= 500:
+        if note_provider_result(False):
+            return fallback_completion(route, messages, max_tokens, params)
+        return response
+    note_provider_result(True)
+
+    if response.status_code == 200:
+        try:
+            data = response.json()
+            completion_tokens = data.get('usage', {}).get('completion_tokens')
+            truncated = data['choices'][0].get('finish_reason') == 'length'
+            if completion_tokens is not None:
+                record_call(route, model, latency, completion_tokens, truncated)
+        except Exception as e:
+            logging.error(f"Не удалось учесть ответ LLM по маршруту '{route}': {e}")
+    return response
+
+def log_route_stats():
+    """Пишет в лог p50/p95 задержки и длины ответа по каждому маршруту и модели."""
+    with llm_stats_lock:
+        load_llm_stats()
+        for route, models in llm_stats.items():
+            for model, stats in models.items():
+                if not stats['latency']:
+                    continue
+                logging.info(
+                    f"LLM '{route}' / {model}: {len(stats['latency'])} вызовов, "
+                    f"задержка p50 {percentile(stats['latency'], 0.5):.1f} с, p95 {percentile(stats['latency'], 0.95):.1f} с, "
+                    f"токены p50 {percentile(stats['tokens'], 0.5)}, p95 {percentile(stats['tokens'], 0.95)}"
+                )
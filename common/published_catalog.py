@@ -0,0 +1,76 @@
+import logging
+from array import array
+
+def create_published_catalog():
+    """
+    Кэш опубликованных постов на время запуска в параллельных массивах: позиция i
+    описывает один пост во всех массивах. Водяные знаки — наибольший id, наибольшее
+    время правки полей (updated_at) и наибольшее время синхронизации (wp_synced_at),
+    уже попавшие в кэш. Колонки создает wp_sync.ensure_sync_columns.
+    """
+    return {
+        'ids': array('q'),
+        'titles': [],
+        'slugs': [],
+        'focuskw': [],
+        'metadesc': [],
+        'keywords': [],
+        # id поста -> позиция в массивах
+        'positions': {},
+        'last_id': 0,
+        'last_updated_at': None,
+        'last_synced_at': None
+    }
+
+def refresh_published_catalog(catalog, conn):
+    """
+    Дочитывает в кэш посты, опубликованные или измененные после водяных знаков.
+    Returns:
+        tuple: (позиции новых постов, позиции измененных постов)
+    """
+    added, changed = [], []
+    try:
+        with conn.cursor() as cursor:
+            # Каждое условие покрыто своим индексом (первичный ключ и частичные индексы
+            # по updated_at и wp_synced_at для status = 'publish'), и они объединяются через BitmapOr
+            cursor.execute("""
+                SELECT id, title, seo_slug, seo_focuskw, seo_metadesc, keywords, updated_at, wp_synced_at
+                FROM posts
+                WHERE status = 'publish'
+                  AND (id > %s OR updated_at > %s OR wp_synced_at > %s)
+                ORDER BY id
+            """, (catalog['last_id'], catalog['last_updated_at'] or '-infinity', catalog['last_synced_at'] or '-infinity'))
+            rows = cursor.fetchall()
+    except Exception as e:
+        logging.error(f"Ошибка при обновлении кэша опубликованных постов: {e}")
+        conn.rollback()
+        return added, changed
+
+    for post_id, title, slug, focuskw, metadesc, keywords, updated_at, synced_at in rows:
+        position = catalog['positions'].get(post_id)
+        if position is None:
+            position = len(catalog['ids'])
+            catalog['positions'][post_id] = position
+            catalog['ids'].append(post_id)
+            catalog['titles'].append(title)
+            catalog['slugs'].append(slug)
+            catalog['focuskw'].append(focuskw)
+            catalog['metadesc'].append(metadesc)
+            catalog['keywords'].append(keywords)
+            added.append(position)
+        else:
+            catalog['titles'][position] = title
+            catalog['slugs'][position] = slug
+            catalog['focuskw'][position] = focuskw
+            catalog['metadesc'][position] = metadesc
+            catalog['keywords'][position] = keywords
+            changed.append(position)
+        catalog['last_id'] = max(catalog['last_id'], post_id)
+        if updated_at and (catalog['last_updated_at'] is None or updated_at > catalog['last_updated_at']):
+            catalog['last_updated_at'] = updated_at
+        if synced_at and (catalog['last_synced_at'] is None or synced_at > catalog['last_synced_at']):
+            catalog['last_synced_at'] = synced_at
+
+    if rows:
+        logging.debug(f"Кэш опубликованных постов: добавлено {len(added)}, изменено {len(changed)}, всего {len(catalog['ids'])}.")
+    return added, changed
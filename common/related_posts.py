@@ -0,0 +1,141 @@
+import re
+import zlib
+
+# Параметры рекомендаций похожих постов
+related_config = {
+    # Размер пространства признаков hashing-векторизатора
+    'n_features': 2 ** 18,
+    'top_k': 3,
+    # Посты с меньшей косинусной близостью в блок не попадают
+    'min_score': 0.1,
+    'heading': 'Related articles'
+}
+
+related_stop_words = {
+    'the', 'and', 'is', 'in', 'to', 'of', 'a', 'for', 'on', 'with', 'as', 'by', 'at', 'from',
+    'your', 'you', 'how', 'what', 'why', 'are', 'can', 'this', 'that', 'its', 'our', 'into'
+}
+
+def tokenize(text):
+    words = [word for word in re.findall(r'[a-z0-9]+', (text or '').lower())
+             if len(word) > 2 and word not in related_stop_words]
+    return words + [f'{first} {second}' for first, second in zip(words, words[1:])]
+
+def hash_features(texts):
+    """Хэширует слова и биграммы текстов. Возвращает {номер признака: частота}."""
+    counts = {}
+    for text in texts:
+        for token in tokenize(text):
+            feature = zlib.crc32(token.encode('utf-8')) % related_config['n_features']
+            counts[feature] = counts.get(feature, 0) + 1
+    return counts
+
+def post_texts(title, focuskw, keywords, metadesc):
+    if isinstance(keywords, (list, tuple)):
+        keywords = ' '.join(keywords)
+    # Заголовок и ключевая фраза — самые точные признаки темы, поэтому входят дважды
+    return [title, title, focuskw, focuskw, keywords, metadesc]
+
+def create_related_index():
+    """
+    Индекс похожих постов: признаки каждого поста хранятся по позиции в кэше опубликованных
+    постов, а для поиска собираются в разреженную матрицу (COO, отсортированную по признаку).
+    """
+    return {
+        # Позиция поста -> {признак: частота}
+        'docs': {},
+        'dirty': True,
+        'matrix': None
+    }
+
+def set_related_doc(index, position, texts):
+    index['docs'][position] = hash_features(texts)
+    index['dirty'] = True
+
+def build_related_matrix(index):
+    """
+    Собирает матрицу: строки, признаки и TF-IDF веса записей, отсортированные по признаку,
+    смещения начала каждого признака, IDF и нормы строк. Выполняется лениво, после добавления постов.
+    """
+    import numpy as np
+
+    positions = np.fromiter(
+        (position for position, features in index['docs'].items() for _ in features), dtype=np.int64
+    )
+    features = np.fromiter(
+        (feature for doc in index['docs'].values() for feature in doc), dtype=np.int64
+    )
+    counts = np.fromiter(
+        (count for doc in index['docs'].values() for count in doc.values()), dtype=np.float64
+    )
+
+    order = np.argsort(features, kind='stable')
+    positions, features, counts = positions[order], features[order], counts[order]
+
+    n_docs = len(index['docs'])
+    df = np.bincount(features, minlength=related_config['n_features'])
+    idf = np.log((1 + n_docs) / (1 + df)) + 1
+    weights = (1 + np.log(counts)) * idf[features]
+    n_rows = (max(index['docs']) + 1) if index['docs'] else 0
+    norms = np.sqrt(np.bincount(positions, weights=weights ** 2, minlength=n_rows))
+
+    index['matrix'] = {
+        'positions': positions,
+        'weights': weights,
+        'starts': np.searchsorted(features, np.arange(related_config['n_features'] + 1)),
+        'idf': idf,
+        'norms': norms
+    }
+    index['dirty'] = False
+
+def find_related(index, texts, exclude_position=None, top_k=None):
+    """
+    Возвращает до top_k пар (позиция, близость) постов, ближайших к текстам нового поста.
+    Вектор запроса умножается на матрицу одним проходом по записям его признаков.
+    """
+    import numpy as np
+
+    if not index['docs']:
+        return []
+    if index['dirty']:
+        build_related_matrix(index)
+    matrix = index['matrix']
+    top_k = top_k or related_config['top_k']
+
+    query = hash_features(texts)
+    if not query:
+        return []
+    query_features = np.fromiter(query.keys(), dtype=np.int64)
+    query_weights = (1 + np.log(np.fromiter(query.values(), dtype=np.float64))) * matrix['idf'][query_features]
+    query_norm = np.sqrt((query_weights ** 2).sum())
+
+    # Записи матрицы для признаков запроса: по одному срезу на признак
+    starts, ends = matrix['starts'][query_features], matrix['starts'][query_features + 1]
+    lengths = ends - starts
+    if not lengths.sum():
+        return []
+    entry_index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    entry_query_weights = np.repeat(query_weights, lengths)
+
+    scores = np.bincount(
+        matrix['positions'][entry_index],
+        weights=matrix['weights'][entry_index] * entry_query_weights,
+        minlength=len(matrix['norms'])
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.nan_to_num(scores / (matrix['norms'] * query_norm))
+    if exclude_position is not None and exclude_position < len(scores):
+        scores[exclude_position] = 0
+
+    top_k = min(top_k, len(scores))
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    candidates = candidates[np.argsort(-scores[candidates])]
+    return [(int(position), float(scores[position])) for position in candidates
+            if scores[position] >= related_config['min_score']]
+
+def build_related_block(items):
+    """Markdown-блок «Related articles» из пар (заголовок, URL)."""
+    if not items:
+        return ''
+    lines = [f"- [{title}]({url})" for title, url in items]
+    return f"\n\n## {related_config['heading']}\n\n" + '\n'.join(lines) + '\n'
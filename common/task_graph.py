@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def run_task_graph(tasks, max_workers=2):
+    """
+    Выполняет граф задач {имя: (функция, [имена зависимостей])}. Задача запускается, как только
+    готовы все ее зависимости, и получает их результаты позиционными аргументами в порядке списка;
+    независимые задачи выполняются параллельно.
+
+    Returns:
+        dict: {имя: результат}. Исключение в задаче отменяет еще не запущенные задачи и пробрасывается.
+    """
+    results = {}
+    pending = dict(tasks)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, (func, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    running[executor.submit(func, *(results[dep] for dep in deps))] = name
+                    del pending[name]
+
+            if not running:
+                missing = {dep for _, deps in pending.values() for dep in deps if dep not in tasks}
+                raise ValueError(f"Граф задач не может продолжиться: неизвестные или циклические зависимости {missing or set(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+    return results
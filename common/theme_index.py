@@ -0,0 +1,104 @@
+import re
+import zlib
+import heapq
+import random
+
+# Параметры индекса тем
+theme_index_config = {
+    'num_perm': 64,
+    # LSH: сигнатура делится на bands полос по rows значений; темы с совпавшей полосой — кандидаты в дубли
+    'bands': 16,
+    'rows': 4,
+    # Оценка близости по Жаккару, начиная с которой новая тема считается дублем существующей
+    'near_duplicate_threshold': 0.5,
+    # Сколько ближайших существующих тем передается в промпт
+    'prompt_themes': 30
+}
+
+theme_stop_words = {
+    'the', 'and', 'is', 'in', 'to', 'of', 'a', 'for', 'on', 'with', 'as', 'by', 'at', 'from',
+    'your', 'you', 'how', 'what', 'why', 'are', 'can', 'this', 'that', 'its', 'our', 'best', 'top'
+}
+
+# Коэффициенты перестановок MinHash: h(x) = (a * x + b) mod p, одинаковые между запусками
+minhash_prime = (1 << 61) - 1
+minhash_seed = random.Random(20240601)
+minhash_permutations = [
+    (minhash_seed.randrange(1, minhash_prime), minhash_seed.randrange(0, minhash_prime))
+    for _ in range(theme_index_config['num_perm'])
+]
+
+def theme_shingles(title, description=None):
+    """Слова и биграммы заголовка и слова описания темы."""
+    title_words = [word for word in re.findall(r'[a-z0-9]+', (title or '').lower())
+                   if len(word) > 2 and word not in theme_stop_words]
+    description_words = [word for word in re.findall(r'[a-z0-9]+', (description or '').lower())
+                         if len(word) > 2 and word not in theme_stop_words]
+    shingles = set(title_words) | set(description_words)
+    shingles.update(f'{first} {second}' for first, second in zip(title_words, title_words[1:]))
+    return shingles
+
+def minhash_signature(shingles):
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    if not hashes:
+        return None
+    return tuple(min((a * value + b) % minhash_prime for value in hashes) for a, b in minhash_permutations)
+
+def estimate_similarity(first, second):
+    return sum(1 for x, y in zip(first, second) if x == y) / len(first)
+
+def create_theme_index():
+    """
+    Индекс тем одной категории: MinHash-сигнатуры заголовков и описаний и LSH-корзины
+    по полосам сигнатуры для быстрого поиска кандидатов в дубли.
+    """
+    return {
+        'themes': [],
+        'signatures': [],
+        # (номер полосы, значения полосы) -> позиции тем
+        'buckets': {}
+    }
+
+def signature_bands(signature):
+    rows = theme_index_config['rows']
+    for band in range(theme_index_config['bands']):
+        yield band, signature[band * rows:(band + 1) * rows]
+
+def add_theme(index, title, description=None):
+    signature = minhash_signature(theme_shingles(title, description))
+    if signature is None:
+        return
+    position = len(index['themes'])
+    index['themes'].append(title)
+    index['signatures'].append(signature)
+    for band_key in signature_bands(signature):
+        index['buckets'].setdefault(band_key, []).append(position)
+
+def find_near_duplicate(index, title, description=None):
+    """Возвращает заголовок существующей темы, почти совпадающей с новой, или None."""
+    signature = minhash_signature(theme_shingles(title, description))
+    if signature is None:
+        return None
+    candidates = set()
+    for band_key in signature_bands(signature):
+        candidates.update(index['buckets'].get(band_key, ()))
+
+    best, best_score = None, theme_index_config['near_duplicate_threshold']
+    for position in candidates:
+        score = estimate_similarity(signature, index['signatures'][position])
+        if score >= best_score:
+            best, best_score = index['themes'][position], score
+    return best
+
+def nearest_themes(index, query, limit=None):
+    """До limit существующих тем, ближайших к запросу (название категории и ключевые слова)."""
+    limit = limit or theme_index_config['prompt_themes']
+    signature = minhash_signature(theme_shingles(query))
+    if signature is None or len(index['themes']) <= limit:
+        return index['themes'][-limit:]
+    nearest = heapq.nlargest(
+        limit,
+        range(len(index['themes'])),
+        key=lambda position: estimate_similarity(signature, index['signatures'][position])
+    )
+    return [index['themes'][position] for position in nearest]
@@ -0,0 +1,191 @@
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from common.wp_sync import (
+    wp_config, create_site, ensure_auth_token, get_db_connection, normalize_slug, normalize_title,
+    ensure_sync_columns
+)
+
+# Параметры сверки: размер страницы листинга WordPress и число параллельных запросов
+reconcile_config = {
+    'per_page': 100,
+    'workers': 4,
+    # Допустимое расхождение часов сервера WordPress и базы при сравнении modified с wp_synced_at
+    'clock_skew': 60
+}
+
+def fetch_wp_posts_page(site, page):
+    """Возвращает (посты страницы, общее число страниц) листинга /wp/v2/posts."""
+    response = site['session'].get(
+        site['config']['api_url'],
+        params={
+            'per_page': reconcile_config['per_page'],
+            'page': page,
+            # Корзина запрашивается, чтобы отличить удаленный редактором пост от пропавшего
+            'status': 'publish,future,draft,pending,private,trash',
+            'orderby': 'id',
+            'order': 'asc',
+            '_fields': 'id,slug,title,modified,modified_gmt,status'
+        },
+        verify=False
+    )
+    if response.status_code != 200:
+        raise RuntimeError(f"страница {page}: {response.status_code} - {response.text}")
+    return response.json(), int(response.headers.get('X-WP-TotalPages', 1))
+
+def fetch_all_wp_posts(site):
+    """
+    Загружает краткий листинг всех постов сайта: первая страница сообщает число страниц,
+    остальные запрашиваются параллельно. Возвращает {wp_post_id: пост}.
+    """
+    first_page, total_pages = fetch_wp_posts_page(site, 1)
+    wp_posts = {item['id']: item for item in first_page}
+
+    with ThreadPoolExecutor(max_workers=reconcile_config['workers']) as executor:
+        for items, _ in executor.map(lambda page: fetch_wp_posts_page(site, page), range(2, total_pages + 1)):
+            wp_posts.update((item['id'], item) for item in items)
+
+    logging.info(f"Получено {len(wp_posts)} постов WordPress за {total_pages} запросов.")
+    return wp_posts
+
+def fetch_db_posts(conn):
+    """
+    Строки для сверки. wp_synced_at приводится к UTC для сравнения с modified_gmt.
+    Явный slug при создании передается с тех пор, как синхронизация пишет wp_sync_hashes;
+    у более ранних постов slug WordPress построил из заголовка.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT id, wp_post_id, seo_slug, status, title,
+                   (wp_synced_at AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'UTC',
+                   wp_sync_hashes IS NOT NULL
+            FROM posts
+            WHERE status = 'publish' OR wp_post_id IS NOT NULL
+        """)
+        return cursor.fetchall()
+
+def modified_after_sync(item, synced_at):
+    """Пост изменен на сайте позже последней синхронизации (правка редактора)."""
+    if synced_at is None or not item.get('modified_gmt'):
+        return False
+    modified = datetime.fromisoformat(item['modified_gmt'])
+    return modified > synced_at + timedelta(seconds=reconcile_config['clock_skew'])
+
+def find_unlinked_match(wp_by_slug, slug, title):
+    """
+    Пост сайта для строки без wp_post_id: по явному slug или (у старых постов) по slug из
+    заголовка. Как и при поиске перед созданием, совпадение засчитывается только при совпадении заголовка.
+    """
+    for candidate in (slug, normalize_slug(title)):
+        match = wp_by_slug.get(candidate) if candidate else None
+        if match and normalize_title(match.get('title', {}).get('rendered')) == normalize_title(title):
+            return match
+    return None
+
+def diff_posts(db_posts, wp_posts):
+    """
+    Сравнивает таблицу posts с листингом WordPress в памяти.
+
+    Returns:
+        dict: 'missing' — строки с wp_post_id, которого нет на сайте;
+              'trashed' — строки, пост которых редактор перенес в корзину (намеренное удаление, не расхождение);
+              'unlinked' — опубликованные строки без wp_post_id, для которых на сайте найден пост по slug
+                           (у старых постов — по slug из заголовка) с тем же заголовком и без другой связанной строки;
+              'orphaned' — посты сайта вне корзины, на которые не ссылается ни одна строка;
+              'stale' — строки, пост которых на сайте снят с публикации, изменен после последней
+                        синхронизации или (для постов с явным slug) имеет другой slug.
+    """
+    report = {'missing': [], 'trashed': [], 'unlinked': [], 'orphaned': [], 'stale': []}
+    wp_by_slug = {item['slug']: item for item in wp_posts.values() if item['status'] != 'trash'}
+    # Пост сайта, на который уже ссылается строка, другой строке не достается
+    linked_ids = {row[1] for row in db_posts if row[1] is not None}
+
+    for post_id, wp_post_id, seo_slug, status, title, synced_at, explicit_slug in db_posts:
+        slug = normalize_slug(seo_slug)
+        if wp_post_id is None:
+            match = find_unlinked_match(wp_by_slug, slug, title)
+            if match and match['id'] not in linked_ids:
+                report['unlinked'].append((post_id, match['id']))
+                linked_ids.add(match['id'])
+            continue
+
+        item = wp_posts.get(wp_post_id)
+        if item is None:
+            report['missing'].append((post_id, wp_post_id))
+            continue
+        if item['status'] == 'trash':
+            report['trashed'].append((post_id, wp_post_id))
+            continue
+
+        reasons = []
+        if item['status'] not in ('publish', 'future'):
+            reasons.append('status')
+        if explicit_slug and slug and item['slug'] != slug:
+            reasons.append('slug')
+        if modified_after_sync(item, synced_at):
+            reasons.append('modified')
+        if reasons:
+            report['stale'].append((post_id, wp_post_id, ','.join(reasons), item['slug'], item['status'], item['modified']))
+
+    report['orphaned'] = [
+        wp_id for wp_id, item in wp_posts.items()
+        if wp_id not in linked_ids and item['status'] != 'trash'
+    ]
+    return report
+
+def repair_posts(conn, site, report):
+    """
+    Исправляет однозначные расхождения: пропавшие на сайте посты возвращаются в очередь 'pre-Draft',
+    найденные по slug — связываются с постом WordPress. Trashed, orphaned и stale только попадают
+    в отчет: редакторы удаляют посты намеренно, создают их вручную и правят.
+    """
+    with conn.cursor() as cursor:
+        for post_id, _ in report['missing']:
+            cursor.execute(
+                "UPDATE posts SET status = 'pre-Draft', wp_post_id = NULL WHERE id = %s",
+                (post_id,)
+            )
+            # Без очистки журнала синхронизация сочтет пост уже созданным
+            cursor.execute(
+                "DELETE FROM wp_sync_journal WHERE post_id = %s AND site = %s",
+                (post_id, site['config']['host'])
+            )
+        for post_id, wp_post_id in report['unlinked']:
+            cursor.execute(
+                "UPDATE posts SET status = 'publish', wp_post_id = %s WHERE id = %s",
+                (wp_post_id, post_id)
+            )
+    conn.commit()
+    logging.info(f"Возвращено в очередь: {len(report['missing'])}, связано по slug: {len(report['unlinked'])}.")
+
+def run_reconcile(repair=False):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    site = create_site(wp_config)
+    try:
+        if ensure_auth_token(site) is None:
+            logging.error("Не удалось получить токен для доступа к WordPress API.")
+            return None
+
+        ensure_sync_columns(conn)
+        wp_posts = fetch_all_wp_posts(site)
+        report = diff_posts(fetch_db_posts(conn), wp_posts)
+
+        for key, rows in report.items():
+            logging.info(f"Сверка: {key} — {len(rows)}.")
+            for row in rows:
+                logging.info(f"  {key}: {row}")
+
+        if repair:
+            repair_posts(conn, site, report)
+    except Exception as e:
+        logging.error(f"Ошибка при сверке с WordPress: {e}")
+        return None
+    finally:
+        conn.close()
+
+    logging.info(f"Выполнено HTTP-запросов к WordPress API: {site['http_requests']}.")
+    return report
@@ -0,0 +1,1400 @@
+import psycopg2
+from psycopg2.extras import execute_values
+import requests
+import logging
+import os
+import re
+import json
+import html
+import hashlib
+import time
+import mimetypes
+import tempfile
+import base64
+import fcntl
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse, unquote
+import threading
+from datetime import datetime
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from common.content import render_markdown, build_structured_data
+
+# Подавление предупреждений SSL
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Конфигурация подключения к базе данных PostgreSQL
+db_config = {
+    'dbname': 'miatennispro',
+    'user': os.getenv('DB_USERNAME'),
+    'password': os.getenv('DB_PASSWORD'),
+    'host': os.getenv('DB_HOST'),
+    'port': '5432'
+}
+
+# Файл блокировки синхронизации: очереди выгружает только один процесс, с какой бы точки
+# входа (общий скрипт, скрипты профилей, ручной запуск) он ни был запущен
+sync_lock_path = os.getenv('WP_SYNC_LOCK_PATH', '/home/ubuntu/scripts/mia/.wp_sync_all.lock')
+
+# Количество постов, читаемых из базы за один раз
+fetch_batch_size = int(os.getenv('WP_SYNC_BATCH_SIZE', 50))
+
+def make_wp_config(host, username, password, token_cache_path, primary=False, min_post_id=0, category_map=None):
+    """Конфигурация подключения к WordPress API одного сайта."""
+    return {
+        'host': host,
+        'api_url': f'https://{host}/wp-json/wp/v2/posts',
+        'api_url_v2': f'https://{host}/wp-json/wp/v2',
+        'media_url': f'https://{host}/wp-json/wp/v2/media',
+        'token_url': f'https://{host}/wp-json/jwt-auth/v1/token',
+        'batch_url': f'https://{host}/wp-json/batch/v1',
+        # Пакетная отправка постов и мета-данных через /batch/v1 (WP_BATCH_MODE=1)
+        'batch_mode': os.getenv('WP_BATCH_MODE', '0') == '1',
+        'username': username,
+        'password': password,
+        # Кэш JWT-токена на диске, общий для синхронизации новостей и блога
+        'token_cache_path': token_cache_path,
+        # За сколько секунд до истечения exp токен обновляется заранее
+        'token_refresh_margin': 600,
+        # Статус основного сайта хранится в posts.status и posts.wp_post_id,
+        # статусы дополнительных сайтов — в таблице post_site_status
+        'primary': primary,
+        # Дополнительный сайт получает только посты с id > min_post_id, без выгрузки всего архива
+        'min_post_id': min_post_id,
+        # ID рубрики в базе (рубрики основного сайта) -> ID рубрики этого сайта.
+        # None — ID совпадают (основной сайт); пост с рубрикой вне карты отправляется без рубрики
+        'category_map': category_map
+    }
+
+# Конфигурация подключения к WordPress API основного сайта
+wp_config = make_wp_config(
+    'miatennispro.com',
+    os.getenv('WP_USERNAME'),
+    os.getenv('WP_PASSWORD'),
+    os.getenv('WP_TOKEN_CACHE_PATH', '/home/ubuntu/scripts/mia/.wp_jwt_token.json'),
+    primary=True
+)
+
+# Дополнительные сайты, получающие те же посты: JSON-список объектов
+# {"host": ..., "username_env": ..., "password_env": ..., "min_post_id": ..., "categories": {"8": 3, ...}}
+# ID рубрик у каждой установки WordPress свои, поэтому "categories" сопоставляет рубрики основного сайта рубрикам этого
+wp_sites_path = os.getenv('WP_SITES_FILE', '/home/ubuntu/scripts/mia/wp_sites.json')
+
+def site_token_cache_path(host):
+    """Кэш токена дополнительного сайта лежит рядом с кэшем основного (WP_TOKEN_CACHE_PATH)."""
+    base, extension = os.path.splitext(wp_config['token_cache_path'])
+    return f"{base}_{host}{extension}"
+
+def load_wp_sites():
+    """Возвращает конфигурации всех сайтов: основной и дополнительные из wp_sites_path."""
+    sites = [wp_config]
+    if not os.path.exists(wp_sites_path):
+        return sites
+    try:
+        with open(wp_sites_path) as sites_file:
+            for item in json.load(sites_file):
+                sites.append(make_wp_config(
+                    item['host'],
+                    os.getenv(item['username_env']),
+                    os.getenv(item['password_env']),
+                    site_token_cache_path(item['host']),
+                    min_post_id=item.get('min_post_id', 0),
+                    category_map={int(key): value for key, value in item.get('categories', {}).items()}
+                ))
+    except Exception as e:
+        logging.error(f"Ошибка чтения списка сайтов {wp_sites_path}: {e}")
+    return sites
+
+# Профили категорий: чем синхронизация новостей отличается от синхронизации блога
+sync_profiles = {
+    'news': {
+        'name': 'news',
+        'category_filter': "category_id = 8",
+        'date_column': 'pub_date',
+        'schema_type': 'NewsArticle',
+        'write_back_images': True,
+        'article_type': 'news article'
+    },
+    'blog': {
+        'name': 'blog',
+        'category_filter': "category_id != 8",
+        'date_column': 'scheduled_date',
+        'schema_type': 'BlogPosting',
+        'write_back_images': False,
+        'article_type': None
+    }
+}
+
+# Поля поста, изменения которых отслеживаются по хэшу для повторной синхронизации
+sync_hash_fields = ('title', 'content', 'tags', 'seo_title', 'seo_metadesc', 'seo_focuskw', 'seo_slug')
+
+# Соответствие SEO-полей таблицы posts мета-полям Yoast
+meta_field_keys = {
+    'seo_title': '_yoast_wpseo_title',
+    'seo_metadesc': '_yoast_wpseo_metadesc',
+    'seo_focuskw': '_yoast_wpseo_focuskw',
+    'seo_slug': '_yoast_wpseo_slug'
+}
+
+# Ограничения для изображений, передаваемых в медиатеку WordPress
+image_config = {
+    'max_bytes': int(os.getenv('WP_IMAGE_MAX_BYTES', 10 * 1024 * 1024)),
+    'allowed_types': {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif'},
+    'chunk_size': 64 * 1024,
+    'timeout': 30,
+    # Оптимизация перед загрузкой: уменьшение до max_width и перекодирование в WEBP или AVIF
+    'optimize': os.getenv('WP_IMAGE_OPTIMIZE', '1') == '1',
+    'max_width': int(os.getenv('WP_IMAGE_MAX_WIDTH', 1200)),
+    'format': os.getenv('WP_IMAGE_FORMAT', 'WEBP'),
+    'quality_preset': os.getenv('WP_IMAGE_QUALITY', 'balanced'),
+    'workers': int(os.getenv('WP_IMAGE_WORKERS', 2)),
+    # Сколько секунд ждать оптимизации одного изображения, прежде чем загрузить оригинал
+    'optimize_timeout': int(os.getenv('WP_IMAGE_OPTIMIZE_TIMEOUT', 120))
+}
+
+# Пресеты качества кодирования изображений
+image_quality_presets = {
+    'high': 85,
+    'balanced': 75,
+    'small': 60
+}
+
+# Пул процессов для оптимизации изображений и статистика за запуск
+image_pool = None
+image_stats = {'original_bytes': 0, 'uploaded_bytes': 0}
+image_stats_lock = threading.Lock()
+
+def create_site(config):
+    """
+    Создает состояние сайта: пул HTTP-соединений, токен и кэши тегов и медиафайлов.
+    Одно состояние используется для всех профилей, синхронизируемых на этом сайте.
+    """
+    site = {
+        'config': config,
+        'session': requests.Session(),
+        'auth_token': None,
+        'token_exp': None,
+        'batch_max_items': None,
+        'batch_checked': False,
+        # Имя тега в нижнем регистре -> ID тега в WordPress
+        'tag_cache': {},
+        # URL исходного изображения -> (ID вложения, URL в медиатеке)
+        'media_cache': {},
+        # Рубрики основного сайта без соответствия на этом сайте (предупреждение выводится один раз)
+        'unmapped_categories': set(),
+        # Slug постов основного сайта, которые есть на этом сайте или стоят в его очереди
+        'post_slugs': None,
+        'http_requests': 0
+    }
+
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    site['session'].mount('https://', adapter)
+    site['session'].mount('http://', adapter)
+    site['session'].headers.update({'Host': config['host']})
+
+    def count_wp_request(response, *args, **kwargs):
+        site['http_requests'] += 1
+
+    site['session'].hooks['response'].append(count_wp_request)
+    return site
+
+def get_db_connection():
+    try:
+        conn = psycopg2.connect(**db_config)
+        logging.info("Подключение к базе данных успешно выполнено.")
+        return conn
+    except Exception as e:
+        logging.error(f"Ошибка подключения к базе данных: {e}")
+        return None
+
+def fetch_pre_draft_posts(conn, site, profile, after_id=0):
+    """
+    Читает очередной пакет постов 'pre-Draft' профиля с id > after_id (keyset-пагинация по id)
+    через именованный серверный курсор, так что в памяти находится только текущий пакет.
+    Для дополнительного сайта очередь — посты основного сайта ('pre-Draft' и 'publish'),
+    которых еще нет в post_site_status этого сайта.
+    """
+    config = site['config']
+    with conn.cursor(name=f"pre_draft_{profile['name']}") as cursor:
+        cursor.itersize = fetch_batch_size
+        if config['primary']:
+            cursor.execute(f"""
+                SELECT id, title, content, tags, {profile['date_column']} AS publish_date, category_id,
+                       seo_title, seo_metadesc, seo_focuskw, seo_slug
+                FROM posts
+                WHERE status = 'pre-Draft' AND {profile['category_filter']} AND id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (after_id, fetch_batch_size))
+        else:
+            cursor.execute(f"""
+                SELECT p.id, p.title, p.content, p.tags, p.{profile['date_column']} AS publish_date, p.category_id,
+                       p.seo_title, p.seo_metadesc, p.seo_focuskw, p.seo_slug
+                FROM posts p
+                LEFT JOIN post_site_status s ON s.post_id = p.id AND s.site = %s
+                WHERE p.status IN ('pre-Draft', 'publish') AND p.{profile['category_filter']}
+                  AND s.post_id IS NULL AND p.id > %s
+                ORDER BY p.id
+                LIMIT %s
+            """, (config['host'], max(after_id, config['min_post_id']), fetch_batch_size))
+        return cursor.fetchall()
+
+def iter_pre_draft_batches(conn, site, profile):
+    after_id = 0
+    while True:
+        posts = fetch_pre_draft_posts(conn, site, profile, after_id)
+        if not posts:
+            break
+        logging.info(f"[{site['config']['host']}/{profile['name']}] Получен пакет из {len(posts)} постов для отправки (id > {after_id}).")
+        yield posts
+        after_id = posts[-1][0]
+
+def get_new_token(site):
+    config = site['config']
+    try:
+        response = site['session'].post(
+            config['token_url'],
+            json={"username": config['username'], "password": config['password']},
+            verify=False
+        )
+        if response.status_code == 200:
+            token = response.json().get("token")
+            logging.info("Успешное получение нового токена.")
+            return token
+        else:
+            logging.error(f"Ошибка при получении нового токена: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        logging.error(f"Ошибка при выполнении запроса на получение токена: {e}")
+        return None
+
+def decode_token_exp(token):
+    """Возвращает claim exp (Unix time) из payload JWT. Подпись не проверяется — это делает WordPress."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except Exception as e:
+        logging.error(f"Не удалось прочитать exp из токена: {e}")
+        return None
+
+def load_cached_token(site):
+    config = site['config']
+    try:
+        with open(config['token_cache_path'], 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        logging.error(f"Ошибка при чтении кэша токена {config['token_cache_path']}: {e}")
+        return None, None
+
+    token, exp = cached.get('token'), cached.get('exp')
+    if not token or not exp or exp - config['token_refresh_margin'] <= time.time():
+        return None, None
+    return token, exp
+
+def save_token_to_cache(site, token, exp):
+    # Пишем во временный файл с правами 0600 и атомарно подменяем кэш
+    path = site['config']['token_cache_path']
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'token': token, 'exp': exp}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Не удалось сохранить токен в кэш {path}: {e}")
+
+def token_expires_soon(site):
+    if site['auth_token'] is None:
+        return True
+    exp = site['token_exp']
+    # Токен без exp считаем действительным до первого отказа WordPress
+    return exp is not None and exp - site['config']['token_refresh_margin'] <= time.time()
+
+def ensure_auth_token(site, force_refresh=False):
+    """
+    Возвращает действующий токен: из памяти, из дискового кэша или запрошенный заново.
+    Токен обновляется заранее, за token_refresh_margin секунд до истечения exp.
+    """
+    if not force_refresh and not token_expires_soon(site):
+        return site['auth_token']
+
+    token, exp = (None, None) if force_refresh else load_cached_token(site)
+    if token:
+        logging.info("Используется токен из кэша.")
+    else:
+        token = get_new_token(site)
+        if token is None:
+            return None
+        exp = decode_token_exp(token)
+        if exp:
+            save_token_to_cache(site, token, exp)
+
+    site['auth_token'] = token
+    site['token_exp'] = exp
+    site['session'].headers.update({"Authorization": f"Bearer {token}"})
+    return token
+
+def get_or_create_tag(site, tag_name):
+    cache_key = tag_name.lower()
+    if cache_key in site['tag_cache']:
+        return site['tag_cache'][cache_key]
+
+    session = site['session']
+    try:
+        response = session.get(
+            f"{site['config']['api_url_v2']}/tags",
+            params={"search": tag_name},
+            verify=False
+        )
+        if response.status_code == 200:
+            tags = response.json()
+            if tags:
+                tag_id = tags[0]['id']
+            else:
+                response = session.post(
+                    f"{site['config']['api_url_v2']}/tags",
+                    json={"name": tag_name},
+                    verify=False
+                )
+                if response.status_code == 201:
+                    tag_id = response.json()['id']
+                else:
+                    logging.error(f"Ошибка при создании тега {tag_name}: {response.status_code} - {response.text}")
+                    return None
+            site['tag_cache'][cache_key] = tag_id
+            return tag_id
+        else:
+            logging.error(f"Ошибка при проверке тега {tag_name}: {response.status_code} - {response.text}")
+            return None
+    except Exception as e:
+        logging.error(f"Ошибка при обработке тега {tag_name}: {e}")
+        return None
+
+def stream_image_chunks(response):
+    """Отдает тело ответа частями и прерывает передачу, если изображение превышает лимит."""
+    received = 0
+    for chunk in response.iter_content(chunk_size=image_config['chunk_size']):
+        received += len(chunk)
+        if received > image_config['max_bytes']:
+            raise ValueError(f"изображение превышает лимит {image_config['max_bytes']} байт")
+        yield chunk
+
+def get_image_filename(image_url, response, mime_type):
+    # Имя файла берем из Content-Disposition источника, иначе из пути URL без query-параметров
+    disposition = response.headers.get('Content-Disposition', '')
+    match = re.search(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', disposition, re.IGNORECASE)
+    name = match.group(1) if match else os.path.basename(urlparse(image_url).path)
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', unquote(name)).strip('._') or 'image'
+
+    # Расширение должно соответствовать фактическому MIME-типу
+    if mimetypes.guess_type(name)[0] != mime_type:
+        name = os.path.splitext(name)[0] + (mimetypes.guess_extension(mime_type) or '')
+    return name
+
+def download_image(image_url):
+    """
+    Скачивает изображение потоком во временный файл, проверяя тип и размер.
+    Возвращает словарь с путем к файлу, именем, MIME-типом и размером или None.
+    """
+    try:
+        with requests.get(
+            image_url,
+            stream=True,
+            timeout=image_config['timeout'],
+            headers={'Accept-Encoding': 'identity'}
+        ) as response:
+            if response.status_code != 200:
+                logging.error(f"Не удалось загрузить изображение по URL {image_url}: {response.status_code}")
+                return None
+
+            mime_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if mime_type not in image_config['allowed_types']:
+                logging.error(f"Тип '{mime_type}' изображения {image_url} не разрешен для загрузки.")
+                return None
+
+            content_length = int(response.headers.get('Content-Length') or 0)
+            if content_length > image_config['max_bytes']:
+                logging.error(f"Изображение {image_url} ({content_length} байт) превышает лимит {image_config['max_bytes']} байт.")
+                return None
+
+            filename = get_image_filename(image_url, response, mime_type)
+            fd, path = tempfile.mkstemp(prefix='wp_image_', suffix=os.path.splitext(filename)[1])
+            try:
+                with os.fdopen(fd, 'wb') as image_file:
+                    for chunk in stream_image_chunks(response):
+                        image_file.write(chunk)
+            except Exception:
+                os.remove(path)
+                raise
+
+        return {'path': path, 'filename': filename, 'mime_type': mime_type, 'size': os.path.getsize(path)}
+    except Exception as e:
+        logging.error(f"Ошибка при скачивании изображения {image_url}: {e}")
+        return None
+
+def optimize_image_file(path, max_width, image_format, quality):
+    """
+    Уменьшает изображение до max_width, перекодирует в WebP/AVIF и отбрасывает метаданные.
+    Выполняется в пуле процессов. Возвращает (путь, размер) результата или None,
+    если перекодирование не уменьшило файл.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as source:
+        if getattr(source, 'is_animated', False):
+            return None
+        img = ImageOps.exif_transpose(source)
+
+    if img.width > max_width:
+        img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if img.mode in ('LA', 'PA') or 'transparency' in img.info else 'RGB')
+
+    # EXIF, ICC и XMP не передаются в save(), поэтому в результат они не попадают
+    out_path = f"{os.path.splitext(path)[0]}_opt.{image_format.lower()}"
+    img.save(out_path, image_format, quality=quality)
+
+    size = os.path.getsize(out_path)
+    if size >= os.path.getsize(path):
+        os.remove(out_path)
+        return None
+    return out_path, size
+
+def start_image_pool():
+    """
+    Создает пул процессов оптимизации до запуска потоков сайтов. Процессы запускаются через
+    spawn: fork из многопоточного процесса копирует захваченные другими потоками блокировки
+    логирования и HTTP, и дочерний процесс может зависнуть навсегда.
+    """
+    global image_pool
+    with image_stats_lock:
+        if image_pool is None:
+            image_pool = ProcessPoolExecutor(max_workers=image_config['workers'], mp_context=get_context('spawn'))
+    return image_pool
+
+def get_image_pool():
+    # Пул общий для сайтов, синхронизируемых в параллельных потоках
+    return image_pool or start_image_pool()
+
+def shutdown_image_pool():
+    global image_pool
+    if image_pool is not None:
+        image_pool.shutdown()
+        image_pool = None
+
+def prepare_image(image_url):
+    """Скачивает изображение и ставит его оптимизацию в пул процессов. Возвращает (download, future)."""
+    download = download_image(image_url)
+    if download is None:
+        return None, None
+
+    future = None
+    if image_config['optimize'] and download['mime_type'] != 'image/gif':
+        quality = image_quality_presets.get(image_config['quality_preset'], image_quality_presets['balanced'])
+        future = get_image_pool().submit(
+            optimize_image_file, download['path'], image_config['max_width'], image_config['format'], quality
+        )
+    return download, future
+
+def upload_prepared_image(site, image_url, download, future):
+    if image_url in site['media_cache']:
+        return site['media_cache'][image_url]
+    if download is None:
+        return None, None
+
+    path, filename, mime_type, size = download['path'], download['filename'], download['mime_type'], download['size']
+    temp_files = [path]
+    if future is not None:
+        try:
+            optimized = future.result(timeout=image_config['optimize_timeout'])
+            if optimized:
+                path, size = optimized
+                temp_files.append(path)
+                extension = image_config['format'].lower()
+                mime_type = f"image/{extension}"
+                filename = f"{os.path.splitext(filename)[0]}.{extension}"
+        except Exception as e:
+            logging.error(f"Не удалось оптимизировать изображение {image_url}, загружается оригинал: {e}")
+
+    with image_stats_lock:
+        image_stats['original_bytes'] += download['size']
+        image_stats['uploaded_bytes'] += size
+
+    try:
+        media_headers = {
+            "Authorization": f"Bearer {site['auth_token']}",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Content-Type": mime_type
+        }
+
+        # Файл передается потоком, без чтения целиком в память
+        with open(path, 'rb') as image_file:
+            media_response = site['session'].post(
+                site['config']['media_url'],
+                headers=media_headers,
+                data=image_file,
+                verify=False
+            )
+
+        if media_response.status_code in [200, 201]:
+            media_json = media_response.json()
+            attachment_id = media_json.get('id')
+            media_url = media_json.get('source_url')
+            logging.info(f"Изображение загружено в WordPress: {media_url}")
+            site['media_cache'][image_url] = (attachment_id, media_url)
+            return attachment_id, media_url
+        else:
+            logging.error(f"Ошибка при загрузке изображения в WordPress: {media_response.status_code} - {media_response.text}")
+            return None, None
+    except Exception as e:
+        logging.error(f"Ошибка при загрузке изображения {image_url}: {e}")
+        return None, None
+    finally:
+        for temp_file in temp_files:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+def discard_prepared_image(download, future):
+    """Удаляет временные файлы изображения, подготовленного, но не загруженного на сайт."""
+    if download is None:
+        return
+    temp_files = [download['path']]
+    if future is not None:
+        try:
+            optimized = future.result(timeout=image_config['optimize_timeout'])
+            if optimized:
+                temp_files.append(optimized[0])
+        except Exception:
+            pass
+    for temp_file in temp_files:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def upload_image_to_wordpress(site, image_url):
+    if image_url in site['media_cache']:
+        return site['media_cache'][image_url]
+    return upload_prepared_image(site, image_url, *prepare_image(image_url))
+
+def ensure_journal_table(conn):
+    """Создает журнал синхронизации, если его еще нет."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS wp_sync_journal (
+                post_id integer NOT NULL,
+                site text NOT NULL,
+                step text NOT NULL,
+                source_url text NOT NULL DEFAULT '',
+                wp_id integer,
+                wp_url text,
+                created_at timestamp NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (post_id, site, step, source_url)
+            )
+        """)
+    conn.commit()
+
+def ensure_queue_index(conn):
+    """
+    Индекс (status, id), по которому пакет очереди 'pre-Draft' читается диапазонным сканом.
+    Сначала проверяется наличие индекса: CREATE INDEX блокирует запись в posts даже с IF NOT EXISTS.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('posts_status_id_idx')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("CREATE INDEX IF NOT EXISTS posts_status_id_idx ON posts (status, id)")
+    conn.commit()
+
+def journal_step(conn, site, post_id, step, source_url='', wp_id=None, wp_url=None):
+    """
+    Фиксирует завершенный шаг синхронизации поста ('media', 'created', 'meta') сразу
+    после ответа WordPress, до следующих действий с постом.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO wp_sync_journal (post_id, site, step, source_url, wp_id, wp_url)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (post_id, site, step, source_url)
+            DO UPDATE SET wp_id = EXCLUDED.wp_id, wp_url = EXCLUDED.wp_url, created_at = NOW()
+        """, (post_id, site['config']['host'], step, source_url, wp_id, wp_url))
+    conn.commit()
+
+def load_journal(conn, site, post_ids):
+    """
+    Читает журнал для пакета постов одним запросом.
+    Возвращает {post_id: {'media': {source_url: (wp_id, wp_url)}, 'created': wp_post_id, 'meta': True}}.
+    """
+    journal = {}
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT post_id, step, source_url, wp_id, wp_url
+            FROM wp_sync_journal
+            WHERE site = %s AND post_id = ANY(%s)
+        """, (site['config']['host'], list(post_ids)))
+        for post_id, step, source_url, wp_id, wp_url in cursor.fetchall():
+            entry = journal.setdefault(post_id, {'media': {}})
+            if step == 'media':
+                entry['media'][source_url] = (wp_id, wp_url)
+            elif step == 'created':
+                entry['created'] = wp_id
+            elif step == 'meta':
+                entry['meta'] = True
+    return journal
+
+def normalize_slug(slug):
+    return re.sub(r'[^a-z0-9]+', '-', (slug or '').lower()).strip('-')
+
+def normalize_title(title):
+    # WordPress типографирует заголовки (кавычки, тире), поэтому сравниваем только буквы и цифры
+    return re.sub(r'\W+', '', html.unescape(title or '').lower())
+
+def find_existing_posts_by_slug(site, posts):
+    """
+    Ищет в WordPress уже созданные посты пакета по slug одним запросом.
+    Совпадение засчитывается, только если совпадает и заголовок. Возвращает {post_id: wp_post_id}.
+    """
+    by_slug = {normalize_slug(post[9]): post for post in posts if normalize_slug(post[9])}
+    if not by_slug:
+        return {}
+
+    try:
+        response = site['session'].get(
+            site['config']['api_url'],
+            params={
+                'slug': ','.join(by_slug),
+                'status': 'publish,future,draft,pending,private',
+                'per_page': 100,
+                '_fields': 'id,slug,title'
+            },
+            verify=False
+        )
+        if response.status_code != 200:
+            logging.error(f"Ошибка при поиске постов по slug: {response.status_code} - {response.text}")
+            return {}
+
+        existing = {}
+        for item in response.json():
+            post = by_slug.get(item.get('slug'))
+            if post and normalize_title(item.get('title', {}).get('rendered')) == normalize_title(post[1]):
+                existing[post[0]] = item['id']
+        return existing
+    except Exception as e:
+        logging.error(f"Ошибка при поиске постов по slug: {e}")
+        return {}
+
+def upload_post_image(site, conn, post_id, image_url, download=None, future=None):
+    """Загружает изображение поста (или берет из кэша) и записывает шаг 'media' в журнал."""
+    if download is None:
+        attachment_id, wp_image_url = upload_image_to_wordpress(site, image_url)
+    else:
+        attachment_id, wp_image_url = upload_prepared_image(site, image_url, download, future)
+    if attachment_id and wp_image_url:
+        journal_step(conn, site, post_id, 'media', image_url, attachment_id, wp_image_url)
+    return attachment_id, wp_image_url
+
+def process_images_in_content(site, conn, profile, content, post_id):
+    """
+    Рендерит Markdown поста в HTML и в том же проходе заменяет источники изображений
+    из post_images (и Markdown-картинок, и тегов <img>) на URL медиатеки сайта.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT image_url, alt_text FROM post_images WHERE post_id = %s", (post_id,))
+    image_urls = {image[0] for image in cursor.fetchall()}
+
+    # Скачиваем изображения поста заранее: пока одно оптимизируется в пуле процессов,
+    # скачиваются и загружаются следующие. Уже загруженные на сайт берутся из кэша
+    prepared = {
+        url: prepare_image(url)
+        for url in image_urls
+        if url in content and url not in site['media_cache']
+    }
+
+    # Источник -> URL в медиатеке: повторные ссылки на то же изображение не загружаются заново
+    resolved = {}
+
+    def resolve_image(img_src):
+        if img_src in resolved:
+            return resolved[img_src]
+        if img_src not in image_urls:
+            return None
+        download, future = prepared.pop(img_src, None) or (None, None)
+        attachment_id, wp_image_url = upload_post_image(site, conn, post_id, img_src, download, future)
+        if not (attachment_id and wp_image_url):
+            logging.error(f"Не удалось обработать изображение {img_src}")
+            return None
+        resolved[img_src] = wp_image_url
+        write_back.append((post_id, img_src, attachment_id, wp_image_url))
+        return wp_image_url
+
+    write_back = []
+    updated_content, image_refs = render_markdown(content, resolve_image)
+
+    # post_images хранит вложения основного сайта; все изображения поста обновляются одним запросом
+    if write_back and profile['write_back_images'] and site['config']['primary']:
+        execute_values(cursor, """
+            UPDATE post_images AS pi
+            SET wp_attachment_id = v.wp_attachment_id, wp_image_url = v.wp_image_url
+            FROM (VALUES %s) AS v (post_id, image_url, wp_attachment_id, wp_image_url)
+            WHERE pi.post_id = v.post_id AND pi.image_url = v.image_url
+        """, write_back)
+        conn.commit()
+
+    # Изображения, подготовленные заранее, но не найденные рендерингом, удаляются с диска
+    for download, future in prepared.values():
+        discard_prepared_image(download, future)
+    # Первое изображение поста в медиатеке — для JSON-LD
+    lead_image = next((resolved[url] for url in image_refs if url in resolved), None)
+    return updated_content, lead_image
+
+# Ссылка на пост основного сайта: https://miatennispro.com/<slug>/
+primary_post_link_pattern = re.compile(
+    rf'https?://(?:www\.)?{re.escape(wp_config["host"])}/([A-Za-z0-9_-]+)/?(?=[\s"\'<>)#?]|$)'
+)
+
+def load_site_post_slugs(site, conn):
+    """
+    Slug постов основного сайта, опубликованных на дополнительном сайте или стоящих в его очереди
+    (id > min_post_id). Загружается один раз за запуск: slug передается при создании поста,
+    поэтому на дополнительном сайте у поста тот же адрес.
+    """
+    if site['post_slugs'] is None:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT p.seo_slug
+                FROM posts p
+                LEFT JOIN post_site_status s ON s.post_id = p.id AND s.site = %s
+                WHERE p.seo_slug IS NOT NULL
+                  AND (s.status = 'publish' OR (p.status IN ('pre-Draft', 'publish') AND p.id > %s))
+            """, (site['config']['host'], site['config']['min_post_id']))
+            site['post_slugs'] = {normalize_slug(row[0]) for row in cursor.fetchall()}
+    return site['post_slugs']
+
+def rewrite_site_links(site, conn, content):
+    """
+    Перекрестные ссылки и блок похожих статей генерируются с адресами основного сайта.
+    На дополнительном сайте ссылка на пост, который там есть, ведет на его собственный домен;
+    ссылка на пост, которого на сайте нет (старше min_post_id), остается на основной.
+    """
+    if site['config']['primary'] or not primary_post_link_pattern.search(content):
+        return content
+    post_slugs = load_site_post_slugs(site, conn)
+
+    def replace_link(match):
+        slug = normalize_slug(match.group(1))
+        if slug in post_slugs:
+            return f"https://{site['config']['host']}/{slug}/"
+        return match.group(0)
+
+    return primary_post_link_pattern.sub(replace_link, content)
+
+def render_post_content(site, conn, profile, post):
+    """Готовит контент поста для WordPress: HTML с изображениями из медиатеки и JSON-LD."""
+    post_id, title, content, publish_date, seo_metadesc = post[0], post[1], post[2], post[4], post[7]
+
+    # Обработка изображений и т.д.
+    html_content, lead_image = process_images_in_content(site, conn, profile, content, post_id)
+    html_content = rewrite_site_links(site, conn, html_content)
+
+    # Добавляем структурированные данные к отрендеренному контенту
+    if profile['schema_type']:
+        html_content += build_structured_data(
+            profile['schema_type'], title, content, seo_metadesc, lead_image,
+            publish_date, datetime.now()
+        )
+    return html_content
+
+def resolve_tag_ids(site, tags):
+    tag_ids = []
+    for tag_name in (tags or '').split(','):
+        tag_name = tag_name.strip()
+        if tag_name:
+            tag_id = get_or_create_tag(site, tag_name)
+            if tag_id:
+                tag_ids.append(tag_id)
+    return tag_ids
+
+def resolve_category_ids(site, category_id):
+    """ID рубрики поста на сайте; пустой список, если для рубрики нет соответствия."""
+    category_map = site['config']['category_map']
+    if category_map is None:
+        return [category_id]
+    if category_id in category_map:
+        return [category_map[category_id]]
+    if category_id not in site['unmapped_categories']:
+        site['unmapped_categories'].add(category_id)
+        logging.warning(f"[{site['config']['host']}] Нет соответствия для рубрики {category_id}, посты отправляются без рубрики.")
+    return []
+
+def prepare_post_data(site, conn, cursor, profile, post):
+    """Готовит тело запроса на создание поста: контент, изображения, теги и обложку."""
+    (post_id, title, content, tags, publish_date, category_id,
+     seo_title, seo_metadesc, seo_focuskw, seo_slug) = post
+
+    content = render_post_content(site, conn, profile, post)
+    tag_ids = resolve_tag_ids(site, tags)
+
+    cursor.execute("SELECT image_url FROM post_images WHERE post_id = %s LIMIT 1", (post_id,))
+    featured_image = cursor.fetchone()
+    if featured_image:
+        featured_image_id, wp_featured_image_url = upload_post_image(site, conn, post_id, featured_image[0])
+    else:
+        featured_image_id = None
+
+    post_data = {
+        "title": title,
+        "content": content,
+        "status": "publish",
+        "date": publish_date.isoformat(),
+        "tags": tag_ids,
+    }
+
+    category_ids = resolve_category_ids(site, category_id)
+    if category_ids:
+        post_data['categories'] = category_ids
+
+    if featured_image_id:
+        post_data['featured_media'] = featured_image_id
+
+    # Явный slug позволяет найти пост после сбоя и не создать его повторно
+    if normalize_slug(seo_slug):
+        post_data['slug'] = normalize_slug(seo_slug)
+
+    return post_data
+
+def compute_field_hashes(post):
+    """Хэши отслеживаемых полей поста: по ним повторная синхронизация находит, что именно изменилось."""
+    values = dict(zip(('title', 'content', 'tags'), post[1:4]))
+    values.update(zip(('seo_title', 'seo_metadesc', 'seo_focuskw', 'seo_slug'), post[6:10]))
+    return {
+        field: hashlib.sha1(str(values[field] or '').encode('utf-8')).hexdigest()
+        for field in sync_hash_fields
+    }
+
+def mark_post_published(conn, cursor, site, post, wp_post_id):
+    logging.info(f"Пост успешно отправлен на {site['config']['host']} с ID {wp_post_id}. Обновление базы данных...")
+    hashes = json.dumps(compute_field_hashes(post))
+    if site['config']['primary']:
+        cursor.execute(
+            """
+            UPDATE posts
+            SET status = %s, wp_post_id = %s, wp_sync_hashes = %s, wp_synced_at = NOW()
+            WHERE id = %s
+            """,
+            ("publish", wp_post_id, hashes, post[0])
+        )
+    else:
+        cursor.execute(
+            """
+            INSERT INTO post_site_status (post_id, site, status, wp_post_id, wp_sync_hashes, wp_synced_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (post_id, site) DO UPDATE
+            SET status = EXCLUDED.status, wp_post_id = EXCLUDED.wp_post_id,
+                wp_sync_hashes = EXCLUDED.wp_sync_hashes, wp_synced_at = NOW()
+            """,
+            (post[0], site['config']['host'], "publish", wp_post_id, hashes)
+        )
+    conn.commit()
+
+def save_sync_hashes(conn, cursor, site, post_id, hashes):
+    if site['config']['primary']:
+        cursor.execute(
+            "UPDATE posts SET wp_sync_hashes = %s, wp_synced_at = NOW() WHERE id = %s",
+            (json.dumps(hashes), post_id)
+        )
+    else:
+        cursor.execute(
+            "UPDATE post_site_status SET wp_sync_hashes = %s, wp_synced_at = NOW() WHERE post_id = %s AND site = %s",
+            (json.dumps(hashes), post_id, site['config']['host'])
+        )
+    conn.commit()
+
+def publish_post(site, conn, cursor, profile, post, post_data):
+    """Поштучная отправка: создание поста и отдельные запросы на каждое мета-данное."""
+    post_id = post[0]
+    session = site['session']
+
+    response = session.post(
+        site['config']['api_url'],
+        json=post_data,
+        verify=False
+    )
+
+    if response.status_code == 403 and "jwt_auth_invalid_token" in response.text:
+        logging.info("Токен истек, получаем новый токен...")
+        if not ensure_auth_token(site, force_refresh=True):
+            logging.error("Не удалось получить новый токен для повторной отправки поста в WordPress.")
+            return
+        response = session.post(
+            site['config']['api_url'],
+            json=post_data,
+            verify=False
+        )
+        if response.status_code != 201:
+            logging.error(f"Ошибка при повторной отправке поста в WordPress: {response.status_code} - {response.text}")
+            return
+
+    if response.status_code == 201:
+        wp_post_id = response.json()["id"]
+        journal_step(conn, site, post_id, 'created', wp_id=wp_post_id)
+        finish_post(site, conn, cursor, profile, post, wp_post_id)
+    else:
+        logging.error(f"Ошибка при отправке поста в WordPress: {response.status_code} - {response.text}")
+
+def finish_post(site, conn, cursor, profile, post, wp_post_id, meta_done=False):
+    """
+    Последние шаги поста, созданного в WordPress: мета-данные, запись в журнал и только затем
+    отметка о публикации. Пост с незаписанными мета-данными остается в очереди, и следующий
+    запуск продолжит его с шага 'meta'.
+    """
+    if not meta_done:
+        if not update_meta_data(site, profile, wp_post_id, *post[6:10]):
+            logging.warning(f"Мета-данные поста {post[0]} (WP ID {wp_post_id}) не записаны, пост остается в очереди.")
+            return
+        journal_step(conn, site, post[0], 'meta')
+    mark_post_published(conn, cursor, site, post, wp_post_id)
+
+def resume_post(site, conn, cursor, profile, post, entry):
+    """Завершает синхронизацию поста, уже созданного в WordPress, начиная с первого незавершенного шага."""
+    wp_post_id = entry['created']
+    logging.info(f"Пост {post[0]} уже создан в WordPress (ID {wp_post_id}), продолжаем с последнего шага.")
+    finish_post(site, conn, cursor, profile, post, wp_post_id, meta_done=entry.get('meta', False))
+
+def get_batch_max_items(site):
+    """
+    Проверяет поддержку /batch/v1 на сайте и возвращает лимит подзапросов в одном пакете.
+    None означает, что пакетный режим недоступен и нужно отправлять посты поштучно.
+    Результат проверки запоминается для сайта.
+    """
+    if site['batch_checked']:
+        return site['batch_max_items']
+    site['batch_checked'] = True
+
+    try:
+        response = site['session'].options(site['config']['batch_url'], verify=False)
+        if response.status_code != 200:
+            logging.info(f"Сайт не поддерживает /batch/v1 ({response.status_code}), используется поштучная отправка.")
+            return None
+        endpoints = response.json().get('endpoints') or [{}]
+        max_items = endpoints[0].get('args', {}).get('requests', {}).get('maxItems')
+        site['batch_max_items'] = int(max_items) if max_items else 25
+        return site['batch_max_items']
+    except Exception as e:
+        logging.error(f"Ошибка при проверке поддержки /batch/v1: {e}")
+        return None
+
+def send_batch(site, sub_requests):
+    """Отправляет пакет подзапросов. Возвращает список ответов или None, если пакет не принят."""
+    session = site['session']
+    batch_url = site['config']['batch_url']
+    try:
+        response = session.post(batch_url, json={"requests": sub_requests}, verify=False)
+        if response.status_code == 403 and "jwt_auth_invalid_token" in response.text:
+            logging.info("Токен истек, получаем новый токен...")
+            if not ensure_auth_token(site, force_refresh=True):
+                return None
+            response = session.post(batch_url, json={"requests": sub_requests}, verify=False)
+        if response.status_code in [200, 207]:
+            return response.json().get('responses', [])
+        logging.error(f"Ошибка при отправке пакета в WordPress: {response.status_code} - {response.text}")
+        return None
+    except Exception as e:
+        logging.error(f"Ошибка при отправке пакета в WordPress: {e}")
+        return None
+
+def publish_posts_in_batches(site, conn, cursor, profile, prepared, max_items):
+    """
+    Создает посты и записывает мета-данные пакетами по max_items подзапросов.
+    Если пакет не принят сервером, его посты отправляются поштучно.
+    """
+    published = []
+    for start in range(0, len(prepared), max_items):
+        chunk = prepared[start:start + max_items]
+        responses = send_batch(site, [
+            {"method": "POST", "path": "/wp/v2/posts", "body": post_data}
+            for _, post_data in chunk
+        ])
+        if responses is None:
+            logging.warning("Пакет не принят, переход на поштучную отправку.")
+            for post, post_data in chunk:
+                publish_post(site, conn, cursor, profile, post, post_data)
+            continue
+
+        for (post, post_data), item in zip(chunk, responses):
+            if item.get('status') == 201:
+                wp_post_id = item['body']['id']
+                journal_step(conn, site, post[0], 'created', wp_id=wp_post_id)
+                published.append((post, wp_post_id))
+            else:
+                logging.error(f"Ошибка при создании поста {post[0]} в пакете: {item.get('status')} - {item.get('body')}")
+
+    for start in range(0, len(published), max_items):
+        chunk = published[start:start + max_items]
+        responses = send_batch(site, [
+            {"method": "PUT", "path": f"/wp/v2/posts/{wp_post_id}", "body": {"meta": build_meta_fields(profile, *post[6:10])}}
+            for post, wp_post_id in chunk
+        ])
+        if responses is None:
+            logging.warning("Пакет мета-данных не принят, переход на поштучное обновление.")
+            for post, wp_post_id in chunk:
+                finish_post(site, conn, cursor, profile, post, wp_post_id)
+            continue
+
+        # Пост отмечается опубликованным только после записи мета-данных в журнал
+        for (post, wp_post_id), item in zip(chunk, responses):
+            if item.get('status') == 200:
+                logging.info(f"Мета-данные успешно обновлены для поста ID {wp_post_id}.")
+                journal_step(conn, site, post[0], 'meta')
+                mark_post_published(conn, cursor, site, post, wp_post_id)
+            else:
+                logging.error(f"Ошибка при обновлении мета-данных поста ID {wp_post_id} в пакете: {item.get('status')} - {item.get('body')}")
+
+def sync_batch(site, conn, cursor, profile, posts, max_items):
+    """Отправляет пакет постов в WordPress. Возвращает False, если не удалось получить токен."""
+    prepared = []
+    token_ok = True
+    if ensure_auth_token(site) is None:
+        logging.error("Не удалось получить токен для доступа к WordPress API.")
+        return False
+
+    # Журнал и поиск по slug выполняются одним запросом на пакет: посты, созданные
+    # до сбоя, не создаются повторно, а их изображения не загружаются заново
+    journal = load_journal(conn, site, [post[0] for post in posts])
+    not_created = [post for post in posts if 'created' not in journal.get(post[0], {})]
+    for post_id, wp_post_id in find_existing_posts_by_slug(site, not_created).items():
+        logging.info(f"Пост {post_id} найден в WordPress по slug (ID {wp_post_id}).")
+        journal_step(conn, site, post_id, 'created', wp_id=wp_post_id)
+        journal.setdefault(post_id, {'media': {}})['created'] = wp_post_id
+
+    for post in posts:
+        if ensure_auth_token(site) is None:
+            logging.error("Не удалось получить токен для доступа к WordPress API.")
+            token_ok = False
+            break
+
+        entry = journal.get(post[0], {'media': {}})
+        if 'created' in entry:
+            resume_post(site, conn, cursor, profile, post, entry)
+            continue
+        site['media_cache'].update(entry['media'])
+
+        post_data = prepare_post_data(site, conn, cursor, profile, post)
+        if max_items:
+            prepared.append((post, post_data))
+        else:
+            publish_post(site, conn, cursor, profile, post, post_data)
+
+    if prepared:
+        publish_posts_in_batches(site, conn, cursor, profile, prepared, max_items)
+
+    return token_ok
+
+def send_posts_to_wordpress(site, conn, profile):
+    """Выгружает очередь 'pre-Draft' одного профиля. Возвращает False, если не удалось получить токен."""
+    cursor = conn.cursor()
+    max_items = get_batch_max_items(site) if site['config']['batch_mode'] else None
+    posts_found = 0
+    token_ok = True
+
+    # Каждый пакет обрабатывается и фиксируется до чтения следующего:
+    # память не зависит от размера очереди, а сбой теряет только текущий пакет
+    for posts in iter_pre_draft_batches(conn, site, profile):
+        posts_found += len(posts)
+        token_ok = sync_batch(site, conn, cursor, profile, posts, max_items)
+        conn.commit()
+        if not token_ok:
+            break
+
+    if posts_found == 0:
+        logging.info(f"[{site['config']['host']}/{profile['name']}] Нет постов для отправки в WordPress.")
+
+    cursor.close()
+    return token_ok
+
+def build_meta_fields(profile, seo_title, seo_metadesc, seo_focuskw, seo_slug):
+    meta_fields = {
+        "_yoast_wpseo_title": seo_title,
+        "_yoast_wpseo_metadesc": seo_metadesc,
+        "_yoast_wpseo_focuskw": seo_focuskw,
+        "_yoast_wpseo_slug": seo_slug
+    }
+    if profile['article_type']:
+        meta_fields["_yoast_wpseo_article_type"] = profile['article_type']
+    return meta_fields
+
+def update_meta_data(site, profile, wp_post_id, seo_title, seo_metadesc, seo_focuskw, seo_slug):
+    """Записывает мета-данные по одному полю. Возвращает True, если записаны все поля."""
+    meta_fields = build_meta_fields(profile, seo_title, seo_metadesc, seo_focuskw, seo_slug)
+    all_updated = True
+
+    for key, value in meta_fields.items():
+        try:
+            meta_data = {
+                "meta": {
+                    key: value
+                }
+            }
+            response = site['session'].put(
+                f"{site['config']['api_url']}/{wp_post_id}",
+                json=meta_data,
+                verify=False
+            )
+
+            if response.status_code == 200:
+                logging.info(f"Мета-данное {key} успешно обновлено для поста ID {wp_post_id}.")
+            else:
+                logging.error(f"Ошибка при обновлении мета-данного {key}: {response.status_code} - {response.text}")
+                all_updated = False
+
+        except Exception as e:
+            logging.error(f"Ошибка при обновлении мета-данного {key} для поста ID {wp_post_id}: {e}")
+            all_updated = False
+
+    return all_updated
+
+def ensure_sync_columns(conn):
+    """
+    Добавляет в posts колонки для повторной синхронизации: updated_at (с триггером, который
+    обновляет его при изменении отслеживаемых полей), хэши полей и время синхронизации,
+    и частичный индекс постов, ожидающих обновления.
+    ALTER TABLE берет на posts эксклюзивную блокировку даже без изменений, поэтому DDL
+    выполняется только для того, чего в базе еще нет.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'posts' AND column_name IN ('updated_at', 'wp_sync_hashes', 'wp_synced_at')
+        """)
+        existing = {row[0] for row in cursor.fetchall()}
+        if len(existing) < 3:
+            cursor.execute("""
+                ALTER TABLE posts
+                    ADD COLUMN IF NOT EXISTS updated_at timestamp NOT NULL DEFAULT NOW(),
+                    ADD COLUMN IF NOT EXISTS wp_sync_hashes jsonb,
+                    ADD COLUMN IF NOT EXISTS wp_synced_at timestamp
+            """)
+        # Режим обновления ищет посты, измененные после синхронизации. Условие сравнивает две колонки,
+        # поэтому индекс частичный с тем же предикатом: в нем только ожидающие обновления посты
+        cursor.execute("SELECT to_regclass('posts_publish_unsynced_idx')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS posts_publish_unsynced_idx
+                ON posts (id)
+                WHERE status = 'publish' AND wp_post_id IS NOT NULL
+                  AND (wp_synced_at IS NULL OR updated_at > wp_synced_at)
+            """)
+        # Прежний индекс по updated_at этот запрос обслужить не мог
+        cursor.execute("SELECT to_regclass('posts_publish_updated_at_idx')")
+        if cursor.fetchone()[0] is not None:
+            cursor.execute("DROP INDEX IF EXISTS posts_publish_updated_at_idx")
+        # Кэш опубликованных постов генератора дочитывает недавно синхронизированные посты
+        cursor.execute("SELECT to_regclass('posts_publish_synced_at_idx')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS posts_publish_synced_at_idx
+                ON posts (wp_synced_at) WHERE status = 'publish'
+            """)
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'posts_touch_updated_at'")
+        if cursor.fetchone() is None:
+            cursor.execute("""
+                CREATE OR REPLACE FUNCTION posts_touch_updated_at() RETURNS trigger AS $$
+                BEGIN
+                    NEW.updated_at = NOW();
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            cursor.execute("""
+                CREATE TRIGGER posts_touch_updated_at
+                BEFORE UPDATE OF title, content, tags, seo_title, seo_metadesc, seo_focuskw, seo_slug ON posts
+                FOR EACH ROW EXECUTE FUNCTION posts_touch_updated_at()
+            """)
+    conn.commit()
+
+def ensure_site_status_table(conn):
+    """Создает таблицу статусов постов на дополнительных сайтах."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS post_site_status (
+                post_id integer NOT NULL,
+                site text NOT NULL,
+                status text NOT NULL,
+                wp_post_id integer,
+                wp_sync_hashes jsonb,
+                wp_synced_at timestamp,
+                PRIMARY KEY (post_id, site)
+            )
+        """)
+    conn.commit()
+
+def changed_posts_query(site, profile, after_id=0):
+    """
+    Запрос пакета опубликованных постов профиля, измененных после последней синхронизации
+    с сайтом (updated_at > wp_synced_at), с keyset-пагинацией по id. Возвращает (sql, параметры).
+    Условие для основного сайта совпадает с предикатом posts_publish_unsynced_idx
+    и должно меняться вместе с ним, иначе планировщик не выберет индекс.
+    """
+    if site['config']['primary']:
+        return f"""
+            SELECT id, title, content, tags, {profile['date_column']} AS publish_date, category_id,
+                   seo_title, seo_metadesc, seo_focuskw, seo_slug, wp_post_id, wp_sync_hashes
+            FROM posts
+            WHERE status = 'publish' AND wp_post_id IS NOT NULL AND {profile['category_filter']}
+              AND (wp_synced_at IS NULL OR updated_at > wp_synced_at)
+              AND id > %s
+            ORDER BY id
+            LIMIT %s
+        """, (after_id, fetch_batch_size)
+    return f"""
+        SELECT p.id, p.title, p.content, p.tags, p.{profile['date_column']} AS publish_date, p.category_id,
+               p.seo_title, p.seo_metadesc, p.seo_focuskw, p.seo_slug, s.wp_post_id, s.wp_sync_hashes
+        FROM posts p
+        JOIN post_site_status s ON s.post_id = p.id AND s.site = %s
+        WHERE s.status = 'publish' AND s.wp_post_id IS NOT NULL AND p.{profile['category_filter']}
+          AND (s.wp_synced_at IS NULL OR p.updated_at > s.wp_synced_at)
+          AND p.id > %s
+        ORDER BY p.id
+        LIMIT %s
+    """, (site['config']['host'], after_id, fetch_batch_size)
+
+def fetch_changed_posts(conn, site, profile, after_id=0):
+    with conn.cursor(name=f"changed_{profile['name']}") as cursor:
+        cursor.itersize = fetch_batch_size
+        cursor.execute(*changed_posts_query(site, profile, after_id))
+        return cursor.fetchall()
+
+def build_update_patch(site, conn, profile, post, changed):
+    """Собирает PATCH только из изменившихся полей поста."""
+    patch = {}
+    if 'title' in changed:
+        patch['title'] = post[1]
+    if 'content' in changed:
+        patch['content'] = render_post_content(site, conn, profile, post)
+    if 'tags' in changed:
+        patch['tags'] = resolve_tag_ids(site, post[3])
+    if 'seo_slug' in changed and normalize_slug(post[9]):
+        patch['slug'] = normalize_slug(post[9])
+
+    meta_values = dict(zip(('seo_title', 'seo_metadesc', 'seo_focuskw', 'seo_slug'), post[6:10]))
+    meta = {meta_field_keys[field]: meta_values[field] for field in meta_field_keys if field in changed}
+    if meta:
+        patch['meta'] = meta
+    return patch
+
+def send_update_patch(site, wp_post_id, patch):
+    url = f"{site['config']['api_url']}/{wp_post_id}"
+    response = site['session'].patch(url, json=patch, verify=False)
+    if response.status_code == 403 and "jwt_auth_invalid_token" in response.text:
+        logging.info("Токен истек, получаем новый токен...")
+        if not ensure_auth_token(site, force_refresh=True):
+            return False
+        response = site['session'].patch(url, json=patch, verify=False)
+    if response.status_code == 200:
+        return True
+    logging.error(f"Ошибка при обновлении поста ID {wp_post_id}: {response.status_code} - {response.text}")
+    return False
+
+def update_changed_posts(site, conn, profile):
+    """
+    Режим обновления: находит опубликованные посты, измененные после синхронизации,
+    сравнивает хэши полей и отправляет в WordPress только отличающиеся поля.
+    Посты без сохраненных хэшей (опубликованные до появления этого режима) получают
+    хэши как исходную точку без отправки.
+    """
+    cursor = conn.cursor()
+    after_id = 0
+    updated = 0
+    while True:
+        posts = fetch_changed_posts(conn, site, profile, after_id)
+        if not posts:
+            break
+        after_id = posts[-1][0]
+
+        journal = load_journal(conn, site, [post[0] for post in posts])
+        for post in posts:
+            if ensure_auth_token(site) is None:
+                logging.error("Не удалось получить токен для доступа к WordPress API.")
+                cursor.close()
+                return False
+
+            post_id, wp_post_id, stored_hashes = post[0], post[10], post[11]
+            hashes = compute_field_hashes(post)
+            changed = {field for field in sync_hash_fields if stored_hashes and stored_hashes.get(field) != hashes[field]}
+
+            if stored_hashes and changed:
+                site['media_cache'].update(journal.get(post_id, {}).get('media', {}))
+                patch = build_update_patch(site, conn, profile, post, changed)
+                if not send_update_patch(site, wp_post_id, patch):
+                    continue
+                logging.info(f"Пост {post_id} (WP ID {wp_post_id}) обновлен, изменены поля: {', '.join(sorted(changed))}.")
+                updated += 1
+
+            save_sync_hashes(conn, cursor, site, post_id, hashes)
+
+    logging.info(f"[{site['config']['host']}/{profile['name']}] Обновлено постов в WordPress: {updated}.")
+    cursor.close()
+    return True
+
+def sync_site(site, profile_names, update_changed):
+    """
+    Выгружает профили на один сайт. У каждого сайта свое подключение к базе:
+    сайты синхронизируются параллельно, и их транзакции не должны смешиваться.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        for name in profile_names:
+            if not send_posts_to_wordpress(site, conn, sync_profiles[name]):
+                break
+            if update_changed and not update_changed_posts(site, conn, sync_profiles[name]):
+                break
+    except Exception as e:
+        logging.error(f"Ошибка синхронизации с {site['config']['host']}: {e}")
+    finally:
+        conn.close()
+    logging.info(f"[{site['config']['host']}] Выполнено HTTP-запросов к WordPress API: {site['http_requests']}.")
+
+def run_sync(profile_names, update_changed=False):
+    """
+    Выгружает очереди указанных профилей на все сайты из load_wp_sites параллельно.
+    У каждого сайта свой пул HTTP-соединений, токен и кэши тегов и медиафайлов;
+    посты генерируются один раз, а публикуются на каждом сайте.
+    С update_changed=True после выгрузки очереди в WordPress отправляются правки
+    уже опубликованных постов.
+    Если синхронизация уже выполняется другим процессом, запуск пропускается.
+    """
+    with open(sync_lock_path, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info("Синхронизация уже выполняется другим процессом, запуск пропущен.")
+            return
+        sync_all_sites(profile_names, update_changed)
+
+def sync_all_sites(profile_names, update_changed):
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        ensure_journal_table(conn)
+        ensure_queue_index(conn)
+        ensure_sync_columns(conn)
+        ensure_site_status_table(conn)
+    finally:
+        conn.close()
+
+    sites = [create_site(config) for config in load_wp_sites()]
+    if image_config['optimize']:
+        start_image_pool()
+    try:
+        with ThreadPoolExecutor(max_workers=len(sites)) as executor:
+            list(executor.map(lambda site: sync_site(site, profile_names, update_changed), sites))
+    finally:
+        shutdown_image_pool()
+
+    saved_bytes = image_stats['original_bytes'] - image_stats['uploaded_bytes']
+    logging.info(f"Оптимизация изображений: исходно {image_stats['original_bytes']} байт, "
+                 f"загружено {image_stats['uploaded_bytes']} байт, сэкономлено {saved_bytes} байт.")
@@ -78,11 +78,12 @@ def main():
         if last_id_after and last_id_after > last_id_before:
             print("Обнаружены новые записи. Продолжаем выполнение скриптов.")
             logging.info("Обнаружены новые записи. Продолжаем выполнение скриптов.")
-            if run_script('/home/ubuntu/scripts/mia/news/2_loc_wp_news_sync_o1.py'):
+            # Один процесс выгружает очереди новостей и блога
+            if run_script('/home/ubuntu/scripts/mia/2_loc_wp_sync_all.py'):
                 logging.info("Цикл завершен. Ожидание 5 минут перед следующим циклом. Запуск из CRONTAB")
             else:
-                print("Ошибка при выполнении 2_loc_wp_news_sync_o1.py")
-                logging.error("Ошибка при выполнении 2_loc_wp_news_sync_o1.py")
+                print("Ошибка при выполнении 2_loc_wp_sync_all.py")
+                logging.error("Ошибка при выполнении 2_loc_wp_sync_all.py")
                 
         else:
             print("Новые записи не обнаружены. Скрипты не запущены.")
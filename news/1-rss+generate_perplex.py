@@ -3,6 +3,7 @@ import requests
 import logging
 import re
 import os
+import sys
 import psycopg2
 from datetime import datetime, timedelta
 from playwright.sync_api import sync_playwright
@@ -14,6 +15,10 @@ from bs4 import BeautifulSoup
 from urllib.parse import urlparse
 from threading import Lock
 
+# Общие модули лежат в каталоге common/ рядом с news/ и posts/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import llm
+
 # Словарь для сопоставления временных зон
 tzinfos = {
     "EST": tz.gettz("America/New_York"),
@@ -41,9 +46,8 @@ logging.basicConfig(
     filemode='a'
 )
 
-# Переменные для API и базы данных
+# Переменные для API и базы данных (модель и max_tokens задает маршрут 'news_article' в common/llm.py)
 API_KEY = os.getenv('API_KEY_PERPLEXITY')
-PERPLEXITY_API_URL = 'https://api.perplexity.ai/chat/completions'
 
 # Подключение к базе данных PostgreSQL
 def get_db_connection():
@@ -737,9 +741,6 @@ def fetch_news_from_perplexity(news_url, title, pub_date, scraped_content, image
 
         # Формируем данные для запроса
         payload = {
-            "model": "llama-3.1-sonar-small-128k-online",
-            "messages": messages,
-            "max_tokens": 2500,
             "temperature": 0.7,
             "top_p": 0.9,
             "return_citations": True,
@@ -752,15 +753,10 @@ def fetch_news_from_perplexity(news_url, title, pub_date, scraped_content, image
             "presence_penalty": 0,
             "frequency_penalty": 1
         }
-
-        headers = {
-            'Authorization': f'Bearer {API_KEY}',
-            'Content-Type': 'application/json'
-        }
         logging.debug(f"Отправляемые данные в Perplexity: {payload}")
-        
+
         # Выполняем запрос к Perplexity API
-        response = requests.post(PERPLEXITY_API_URL, headers=headers, json=payload)
+        response = llm.chat_completion('news_article', API_KEY, messages, **payload)
 
         # Проверка успешного выполнения запроса
         if response.status_code == 200:
@@ -948,6 +944,8 @@ def main():
         # Теперь запускаем процесс обработки новостей и отправки их модели
         process_unprocessed_news(conn)
 
+        llm.log_route_stats()
+
         # Логируем успешное завершение всех процессов
         logging.info("Все процессы завершены. Обработка всех новостей завершена.")
 
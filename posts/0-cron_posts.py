@@ -40,13 +40,14 @@ def main():
         # print(f"Последний ID после запуска скрипта: {last_id_after}")
         # logging.info(f"Последний ID после запуска скриптов: {last_id_after}")
 
-        if run_script('/home/ubuntu/scripts/mia/posts/2_loc_wp_blog-posts_sync_o1.py'):
+        # Один процесс выгружает очереди новостей и блога
+        if run_script('/home/ubuntu/scripts/mia/2_loc_wp_sync_all.py'):
                 logging.info("Цикл завершен. Следующий запуск через 24 часа. Запуск из CRONTAB")
             # print("Обнаружены новые записи. Продолжаем выполнение скриптов.")
             # logging.info("Обнаружены новые записи. Продолжаем выполнение скриптов.")
         else:
-            print("Ошибка при выполнении 2_loc_wp_blog-posts_sync_o1.py")
-            logging.error("Ошибка при выполнении 2-post_blog_sync.py")
+            print("Ошибка при выполнении 2_loc_wp_sync_all.py")
+            logging.error("Ошибка при выполнении 2_loc_wp_sync_all.py")
     else:
         print("Ошибка при выполнении 1-posts_gen-llama_sonar31-sm.py")
         logging.error("Ошибка при выполнении 1-posts_gen-llama_sonar31-sm.py")
@@ -1,11 +1,20 @@
-import requests
-import psycopg2
 from datetime import datetime, timedelta
 import re
 import logging
-import urllib.parse
 import os
+import sys
 import json
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.pool import ThreadedConnectionPool
+
+# Shared modules live in common/ next to news/ and posts/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import cross_links, related_posts, theme_index, keyword_research, image_search, keyword_extractor, llm
+from common.task_graph import run_task_graph
+from common.published_catalog import create_published_catalog, refresh_published_catalog
+from common.wp_sync import ensure_sync_columns
 
 # Configure logging
 def configure_logging():
@@ -22,7 +31,7 @@ def configure_logging():
     logging.basicConfig(
         filename=log_file,
         level=logging.DEBUG,  # Установите на logging.INFO для уменьшения подробности
-        format="%(asctime)s - %(levelname)s - %(message)s"
+        format="%(asctime)s - %(levelname)s - %(threadName)s - %(message)s"
     )
 
 # Database configuration
@@ -40,16 +49,50 @@ perplexity_api_key = os.getenv('API_KEY_PERPLEXITY')
 # Pixabay API configuration
 pixabay_api_key = os.getenv('API_KEY_PIXABAY')
 
-# Function to establish a connection to the PostgreSQL database
-def get_db_connection():
+# Pipeline concurrency: articles are written from the theme inventory while categories
+# below the low watermark refill it in the background
+pipeline_config = {
+    'category_workers': int(os.getenv('POSTS_CATEGORY_WORKERS', 5)),
+    'article_workers': int(os.getenv('POSTS_ARTICLE_WORKERS', 4)),
+    # Global cap on concurrent logical Perplexity calls from both stages. A slow call is hedged
+    # (llm.hedged_post) with one duplicate request that the semaphore does not count, so the API
+    # sees up to 2 * api_concurrency requests; a losing duplicate still waiting for headers runs
+    # on until the server answers or the read timeout, after its slot has been released
+    'api_concurrency': int(os.getenv('POSTS_API_CONCURRENCY', 4)),
+    # Unused themes per category are kept between required_themes (low watermark)
+    # and theme_high_factor * required_themes (high watermark)
+    'theme_high_factor': int(os.getenv('POSTS_THEME_HIGH_FACTOR', 3))
+}
+api_semaphore = threading.BoundedSemaphore(pipeline_config['api_concurrency'])
+
+# Function to create a connection pool shared by the pipeline workers
+def create_connection_pool():
     try:
-        conn = psycopg2.connect(**db_config)
-        logging.info("Connected to the database successfully.")
-        return conn
+        pool = ThreadedConnectionPool(
+            1,
+            # Each article worker holds a second connection for its parallel image search.
+            # Connections are held per logical LLM call, so hedged duplicates (up to
+            # 2 * api_concurrency requests, see pipeline_config) need no extra connections
+            pipeline_config['category_workers'] + 2 * pipeline_config['article_workers']
+            + image_search.image_search_config['prefetch_workers'] + 1,
+            **db_config
+        )
+        logging.info("Database connection pool created successfully.")
+        return pool
     except Exception as e:
         logging.error(f"Database connection error: {e}")
         return None
 
+@contextmanager
+def pooled_connection(pool):
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        # Never hand a connection with an open transaction back to the pool
+        conn.rollback()
+        pool.putconn(conn)
+
 # Function to retrieve specified categories
 def get_categories():
     categories = [
@@ -62,44 +105,36 @@ def get_categories():
     logging.debug(f"Using specified categories: {categories}")
     return categories
 
-# Function to get keywords for a category using Pyusuggest (Google Autocomplete)
+# Function to get keywords for a category using Google Autocomplete
+# (expanded over letter / question-word variants and cached per seed with a TTL)
 def get_keywords_for_category(category_name):
-    url = 'http://suggestqueries.google.com/complete/search'
-    params = {
-        'client': 'firefox',
-        'q': category_name,
-        'hl': 'en'
-    }
-    headers = {
-        'User-Agent': 'Mozilla/5.0'
-    }
-    try:
-        response = requests.get(url, params=params, headers=headers)
-        if response.status_code == 200:
-            suggestions = response.json()[1]
-            keywords = suggestions
-            logging.debug(f"Keywords for category '{category_name}': {keywords}")
-            return keywords
-        else:
-            logging.error(f"Failed to get keywords for category '{category_name}'. Status code: {response.status_code}")
-            return []
-    except Exception as e:
-        logging.error(f"Exception while fetching keywords for category '{category_name}': {e}")
-        return []
+    keywords = keyword_research.research_keywords(category_name)
+    if keywords:
+        logging.debug(f"Keywords for category '{category_name}': {keywords}")
+    else:
+        logging.error(f"Failed to get keywords for category '{category_name}'.")
+    return keywords
 
 # Function to retrieve existing themes for a category from the database
 def get_existing_themes(conn, category_id):
     cursor = conn.cursor()
     try:
-        query = "SELECT theme FROM blog_post_theme WHERE category_id = %s"
+        query = "SELECT theme, description FROM blog_post_theme WHERE category_id = %s ORDER BY id"
         cursor.execute(query, (category_id,))
-        existing_themes = [row[0] for row in cursor.fetchall()]
-        logging.debug(f"Existing themes for category {category_id}: {existing_themes}")
+        existing_themes = cursor.fetchall()
+        logging.debug(f"Fetched {len(existing_themes)} existing themes for category {category_id}.")
         return existing_themes
     except Exception as e:
         logging.error(f"Error fetching existing themes for category {category_id}: {e}")
         return []
 
+# Function to build the near-duplicate index of a category's existing themes
+def load_theme_index(conn, category_id):
+    index = theme_index.create_theme_index()
+    for theme, description in get_existing_themes(conn, category_id):
+        theme_index.add_theme(index, theme, description)
+    return index
+
 # Function to create a prompt for generating new themes
 def create_theme_prompt(category_name, existing_themes, keywords):
     existing_themes_str = '; '.join(existing_themes)
@@ -131,22 +166,13 @@ def create_theme_prompt(category_name, existing_themes, keywords):
     return [system_prompt, user_prompt]
 
 # Function to generate new themes using the Perplexity.ai API
+# (model and max_tokens come from the 'theme_ideas' route)
 def generate_new_themes(prompts, perplexity_api_key):
-    payload = {
-        "model": "llama-3.1-sonar-small-128k-online",
-        "messages": prompts,
-        "max_tokens": 500,
-        "temperature": 0.7,
-        "top_p": 0.9,
-        "stream": False
-    }
-    headers = {
-        'Authorization': f'Bearer {perplexity_api_key}',
-        'Content-Type': 'application/json'
-    }
-    logging.debug(f"Sending request to Perplexity.ai API with payload: {payload}")
+    logging.debug(f"Sending theme request to Perplexity.ai API with messages: {prompts}")
     try:
-        response = requests.post('https://api.perplexity.ai/chat/completions', headers=headers, json=payload)
+        with api_semaphore:
+            response = llm.chat_completion('theme_ideas', perplexity_api_key, prompts,
+                                           temperature=0.7, top_p=0.9, stream=False)
         if response.status_code == 200:
             data = response.json()
             logging.debug(f"Received response from Perplexity.ai API: {data}")
@@ -236,12 +262,14 @@ def save_theme_to_db(conn, category_id, theme_title, theme_description, keywords
             query = """
             INSERT INTO blog_post_theme (category_id, theme, keywords, description)
             VALUES (%s, %s, %s, %s)
+            RETURNING id
             """
             keywords_str = ', '.join(keywords)
             cursor.execute(query, (category_id, theme_title, keywords_str, theme_description))
+            theme_id = cursor.fetchone()[0]
             conn.commit()
             logging.info(f"Saved new theme '{theme_title}' to database.")
-            return True
+            return theme_id
     except Exception as e:
         logging.error(f"Error saving theme '{theme_title}': {e}")
         conn.rollback()
@@ -386,22 +414,13 @@ def create_personal_blog_prompt(theme, description, keywords):
     return [system_prompt, user_prompt]
 
 # Function to generate an article using the Perplexity.ai API
+# (model and max_tokens come from the 'blog_article' route)
 def generate_article(prompts, perplexity_api_key):
-    payload = {
-        "model": "llama-3.1-sonar-small-128k-online",
-        "messages": prompts,
-        "max_tokens": 2500,
-        "temperature": 0.7,
-        "top_p": 0.9,
-        "stream": False
-    }
-    headers = {
-        'Authorization': f'Bearer {perplexity_api_key}',
-        'Content-Type': 'application/json'
-    }
-    logging.debug(f"Sending request to Perplexity.ai API with payload: {payload}")
+    logging.debug(f"Sending article request to Perplexity.ai API with messages: {prompts}")
     try:
-        response = requests.post('https://api.perplexity.ai/chat/completions', headers=headers, json=payload)
+        with api_semaphore:
+            response = llm.chat_completion('blog_article', perplexity_api_key, prompts,
+                                           temperature=0.7, top_p=0.9, stream=False)
         if response.status_code == 200:
             data = response.json()
             logging.debug(f"Received response from Perplexity.ai API: {data}")
@@ -565,113 +584,100 @@ def extract_post_data(final_content):
         return None
 
 
-# Function to extract keywords from content
+# Document frequencies of words and bigrams over all posts, loaded once per run
+# and updated as each post is saved
+keyword_model = keyword_extractor.create_keyword_model()
+
+# Function to extract keywords from content (TF-IDF against the posts corpus, with bigrams)
 def extract_keywords(content):
-    # Simple keyword extraction by removing stop words and selecting unique words
-    words = re.findall(r'\b\w+\b', content.lower())
-    stop_words = set(['the', 'and', 'is', 'in', 'to', 'of', 'a', 'for', 'on', 'with', 'as', 'by', 'at', 'from'])
-    keywords = list(set(words) - stop_words)
-    keywords = [word for word in keywords if len(word) > 2]  # Remove very short words
-    return keywords[:10]  # Return top 10 keywords
-
-# Function to retrieve published articles from the database
-def get_published_articles(conn, exclude_id=None):
-    cursor = conn.cursor()
-    try:
-        if exclude_id:
-            cursor.execute("SELECT title, seo_slug FROM posts WHERE id != %s AND status = 'publish'", (exclude_id,))
-        else:
-            cursor.execute("SELECT title, seo_slug FROM posts WHERE status = 'publish'")
-        articles = cursor.fetchall()
-        published_articles = [{'title': row[0], 'slug': row[1]} for row in articles]
-        logging.debug(f"Retrieved {len(published_articles)} published articles for cross-linking.")
-        return published_articles
-    except Exception as e:
-        logging.error(f"Error fetching published articles: {e}")
-        return []
+    return keyword_extractor.extract_keywords(keyword_model, content)
+
+# Published articles, loaded once per run and refreshed incrementally by id / change time
+published_catalog = create_published_catalog()
+
+def get_article_url(slug):
+    return f"https://miatennispro.com/{slug}/"
+
+# Cross-link automaton over published titles and focus keyphrases, and the related-post
+# index over the same catalog, both kept for the whole run
+link_indexes = {'cross_links': None, 'related': related_posts.create_related_index()}
+# Article workers share the catalog and both indexes
+link_indexes_lock = threading.Lock()
+
+def refresh_link_indexes(conn):
+    added, changed = refresh_published_catalog(published_catalog, conn)
+    index = link_indexes['cross_links']
+    # Phrases cannot be removed from the trie, so an edited published post means a full rebuild
+    if index is None or changed:
+        index = cross_links.create_link_index()
+        link_indexes['cross_links'] = index
+        positions = range(len(published_catalog['ids']))
+    else:
+        positions = added
+    for position in positions:
+        link = get_article_url(published_catalog['slugs'][position])
+        cross_links.add_link_phrase(index, published_catalog['titles'][position], link)
+        cross_links.add_link_phrase(index, published_catalog['focuskw'][position], link)
+
+    for position in list(added) + list(changed):
+        related_posts.set_related_doc(link_indexes['related'], position, related_posts.post_texts(
+            published_catalog['titles'][position], published_catalog['focuskw'][position],
+            published_catalog['keywords'][position], published_catalog['metadesc'][position]
+        ))
 
 # Function to insert cross-links into the article content
 def insert_cross_links(content, conn, exclude_post_id=None):
-    published_articles = get_published_articles(conn, exclude_id=exclude_post_id)
-    
-    for article in published_articles:
-        title = article['title']
-        slug = article['slug']
-        link = f'https://miatennispro.com/{slug}/'
-        content = re.sub(rf'\b{re.escape(title)}\b', f'<a href="{link}">{title}</a>', content)
-    
+    with link_indexes_lock:
+        refresh_link_indexes(conn)
+        excluded = published_catalog['positions'].get(exclude_post_id)
+        exclude_urls = {get_article_url(published_catalog['slugs'][excluded])} if excluded is not None else set()
+        content = cross_links.insert_cross_links(link_indexes['cross_links'], content, exclude_urls=exclude_urls)
     logging.debug("Inserted cross-links into content.")
     return content
 
+# Function to append a "Related articles" block of the most similar published posts
+def append_related_articles(content, post_data, conn, exclude_post_id=None):
+    with link_indexes_lock:
+        refresh_link_indexes(conn)
+        try:
+            related = related_posts.find_related(
+                link_indexes['related'],
+                related_posts.post_texts(post_data['title'], post_data['focus_keyphrase'],
+                                         post_data.get('keywords'), post_data['meta_description']),
+                exclude_position=published_catalog['positions'].get(exclude_post_id)
+            )
+        except Exception as e:
+            logging.error(f"Error finding related articles: {e}")
+            return content
+
+        items = []
+        for position, score in related:
+            url = get_article_url(published_catalog['slugs'][position])
+            # Posts already linked inline are not repeated in the block
+            if url not in content:
+                items.append((published_catalog['titles'][position], url))
+                logging.debug(f"Related article '{published_catalog['titles'][position]}' (score {score:.2f}).")
+    return content + related_posts.build_related_block(items)
+
 # Function to get image URL from Pixabay based on a query
+# (normalized query key, in-memory LRU over the images table, quota limiter, rotation of hits)
 def get_image_url(query, pixabay_api_key, conn, source='pixabay'):
-    cursor = conn.cursor()
-    try:
-        # Check if the image already exists in the database
-        cursor.execute("SELECT image_url FROM images WHERE query = %s", (query,))
-        result = cursor.fetchone()
-        if result:
-            logging.debug("Image URL retrieved from database.")
-            return result[0]
-        else:
-            # Properly URL-encode the query
-            encoded_query = urllib.parse.quote(query)
-            # Make a request to Pixabay
-            url = f"https://pixabay.com/api/?key={pixabay_api_key}&q={encoded_query}&image_type=photo&per_page=3&safesearch=true&order=popular"
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('hits'):
-                    image_url = data['hits'][0]['webformatURL']
-                    logging.debug(f"Retrieved image URL: {image_url}")
-                    # Save the image URL to the database
-                    cursor.execute(
-                        "INSERT INTO images (query, image_url, source, timestamp) VALUES (%s, %s, %s, NOW())",
-                        (query, image_url, source)
-                    )
-                    conn.commit()
-                    return image_url
-                else:
-                    logging.debug("No image found for the query.")
-                    return None
-            else:
-                logging.error(f"Error fetching image from Pixabay: {response.status_code}")
-                return None
-    except Exception as e:
-        logging.error(f"Exception while fetching image from Pixabay: {e}")
-        return None
-
-# Function to save image information to the database
-def save_image_info(conn, post_id, image_url, alt_text):
-    cursor = conn.cursor()
-    try:
-        query = """
-        INSERT INTO post_images (post_id, image_url, alt_text)
-        VALUES (%s, %s, %s)
-        """
-        cursor.execute(query, (post_id, image_url, alt_text))
-        conn.commit()
-        logging.info(f"Saved image info for post ID {post_id}.")
-    except Exception as e:
-        logging.error(f"Error saving image info for post ID {post_id}: {e}")
-        conn.rollback()
+    image_url = image_search.get_image_url(query, pixabay_api_key, conn, source)
+    if image_url:
+        logging.debug(f"Retrieved image URL: {image_url}")
+    return image_url
 
 # Function to integrate images into the article content
-def integrate_images_into_content(content, theme, pixabay_api_key, conn, post_id):
-    image_url = get_image_url(theme, pixabay_api_key, conn)
+def integrate_images_into_content(content, theme, image_url):
+    """Returns the content with {{IMAGE}} placeholders resolved and the (image_url, alt_text) pairs to save."""
     if image_url:
         image_html = f'<img src="{image_url}" alt="{theme}" />'
-        content_with_image = content.replace('{{IMAGE}}', image_html)
         logging.debug("Integrated image into content.")
-        # Save image info
-        save_image_info(conn, post_id, image_url, theme)
-        return content_with_image
-    else:
-        content_without_placeholder = content.replace('{{IMAGE}}', '')
-        return content_without_placeholder
+        return content.replace('{{IMAGE}}', image_html), [(image_url, theme)]
+    return content.replace('{{IMAGE}}', ''), []
 
-# Function to save the generated post to the database
-def save_post_to_database(conn, post_data, category_id, theme_id):
+# Function to save the generated post and its images to the database in one transaction
+def save_post_to_database(conn, post_data, category_id, theme_id, images=()):
     cursor = conn.cursor()
     try:
         query = """
@@ -688,12 +694,18 @@ def save_post_to_database(conn, post_data, category_id, theme_id):
         post_data['scheduled_date'] = datetime.now() + timedelta(days=1)
         post_data['category_id'] = category_id
         post_data['news_id'] = theme_id
-        post_data['keywords'] = extract_keywords(post_data['content'])
 
         cursor.execute(query, post_data)
         post_id = cursor.fetchone()[0]
+        for image_url, alt_text in images:
+            cursor.execute(
+                "INSERT INTO post_images (post_id, image_url, alt_text) VALUES (%s, %s, %s)",
+                (post_id, image_url, alt_text)
+            )
+        terms = keyword_extractor.record_document(cursor, post_data['content'], post_id)
         conn.commit()
-        logging.info(f"Saved post '{post_data['title']}' to database with ID {post_id}.")
+        keyword_extractor.apply_document(keyword_model, terms)
+        logging.info(f"Saved post '{post_data['title']}' to database with ID {post_id} and {len(images)} images.")
         return post_id
     except Exception as e:
         logging.error(f"Error saving post '{post_data['title']}': {e}")
@@ -713,71 +725,96 @@ def get_required_themes_for_category(conn, category_id):
         logging.error(f"Error fetching required themes for category {category_id}: {e}")
         return 5
 
-# Function to retrieve themes that need articles generated
-def get_themes_to_generate_articles(conn):
+# Function to retrieve the oldest unused themes of a category (its theme inventory)
+def get_themes_to_generate_articles(conn, category_id, limit):
     cursor = conn.cursor()
     try:
         cursor.execute("""
             SELECT id, category_id, theme, keywords, description
             FROM blog_post_theme
-            WHERE id NOT IN (SELECT news_id FROM posts)
-        """)
+            WHERE category_id = %s AND id NOT IN (SELECT news_id FROM posts)
+            ORDER BY id
+            LIMIT %s
+        """, (category_id, limit))
         themes = cursor.fetchall()
-        logging.debug(f"Retrieved {len(themes)} themes to generate articles.")
+        logging.debug(f"Retrieved {len(themes)} themes to generate articles for category {category_id}.")
         return themes
     except Exception as e:
         logging.error(f"Error fetching themes for article generation: {e}")
         return []
 
-# Main function to orchestrate the script
-def main():
-    configure_logging()
-    logging.info("Script started.")
-
-    conn = get_db_connection()
-    if not conn:
-        logging.error("Database connection failed. Exiting script.")
-        return
-
+# Function to count the unused themes of a category
+def count_unused_themes(conn, category_id):
+    cursor = conn.cursor()
     try:
-        perplexity_api_key_local = perplexity_api_key  # Ensure using the correct API key
-        pixabay_api_key_local = pixabay_api_key
-
-        categories = get_categories()
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM blog_post_theme
+            WHERE category_id = %s AND id NOT IN (SELECT news_id FROM posts)
+        """, (category_id,))
+        return cursor.fetchone()[0]
+    except Exception as e:
+        logging.error(f"Error counting unused themes for category {category_id}: {e}")
+        return None
 
-        for category in categories:
-            category_id = category['category_id']
-            category_name = category['category_name']
-            logging.info(f"Processing category '{category_name}' (ID: {category_id}).")
+# Function to refill the theme inventory of one category. Nothing is generated while the
+# category has at least trigger_level unused themes; otherwise themes are generated up to
+# the high watermark. reserved themes are already taken by the article stage of this run;
+# the first `wanted` saved themes are passed to submit_article (a category that ran dry).
+def refill_theme_inventory(pool, category, trigger_level='low', reserved=0, wanted=0, submit_article=None):
+    category_id = category['category_id']
+    category_name = category['category_name']
 
-            required_new_themes = get_required_themes_for_category(conn, category_id)
+    try:
+        with pooled_connection(pool) as conn:
+            required_themes = get_required_themes_for_category(conn, category_id)
+            low_watermark = required_themes
+            high_watermark = required_themes * pipeline_config['theme_high_factor']
+            unused_themes = count_unused_themes(conn, category_id)
+            if unused_themes is None:
+                return
+            available = unused_themes - reserved
+            threshold = low_watermark if trigger_level == 'low' else high_watermark
+            if available >= threshold:
+                logging.debug(f"Theme inventory of category '{category_name}' is at {available} (low {low_watermark}, high {high_watermark}). No refill needed.")
+                return
+
+            required_new_themes = high_watermark - available
+            logging.info(f"Refilling theme inventory of category '{category_name}' (ID: {category_id}) from {available} to {high_watermark}.")
             new_themes_added = 0
-            max_attempts = 5
+            # Each response carries up to 5 ideas
+            max_attempts = 5 + required_new_themes // 5
             attempts = 0
 
-            themes_already_added = set()
+            # Loaded once per category and extended as themes are saved
+            category_themes = load_theme_index(conn, category_id)
 
             while new_themes_added < required_new_themes and attempts < max_attempts:
-                existing_themes = get_existing_themes(conn, category_id)
                 keywords = get_keywords_for_category(category_name)
 
+                # Only the existing themes closest to this category's keywords go into the prompt
+                existing_themes = theme_index.nearest_themes(category_themes, ' '.join([category_name] + keywords))
                 prompts = create_theme_prompt(category_name, existing_themes, keywords)
-                generated_content = generate_new_themes(prompts, perplexity_api_key_local)
-                
+                generated_content = generate_new_themes(prompts, perplexity_api_key)
+
                 if generated_content:
                     new_themes = parse_generated_ideas(generated_content)
                     unique_new_themes = []
                     for idea in new_themes:
                         theme_title = idea['title']
-                        if (theme_title not in existing_themes) and (theme_title not in themes_already_added):
+                        duplicate_of = theme_index.find_near_duplicate(category_themes, theme_title, idea['description'])
+                        if duplicate_of is None:
                             unique_new_themes.append(idea)
-                            themes_already_added.add(theme_title)
+                            # Indexed right away so that near-duplicates within one response are caught too
+                            theme_index.add_theme(category_themes, theme_title, idea['description'])
                         else:
-                            logging.warning(f"Duplicate theme '{theme_title}' detected. Skipping.")
+                            logging.warning(f"Theme '{theme_title}' is a near-duplicate of '{duplicate_of}'. Skipping.")
                     for idea in unique_new_themes:
-                        success = save_theme_to_db(conn, category_id, idea['title'], idea['description'], keywords)
-                        if success:
+                        theme_id = save_theme_to_db(conn, category_id, idea['title'], idea['description'], keywords)
+                        if theme_id:
                             new_themes_added += 1
+                            if submit_article and new_themes_added <= wanted:
+                                submit_article((theme_id, category_id, idea['title'], ', '.join(keywords), idea['description']))
                             if new_themes_added >= required_new_themes:
                                 break
                     if new_themes_added < required_new_themes:
@@ -788,63 +825,140 @@ def main():
                 attempts += 1
 
             if new_themes_added < required_new_themes:
-                logging.warning(f"Could not generate the required number of new themes for category '{category_name}'. Only {new_themes_added} were added.")
+                logging.warning(f"Could not refill the theme inventory of category '{category_name}' to {high_watermark}. Only {new_themes_added} themes were added.")
             else:
-                logging.info(f"Successfully added {new_themes_added} new themes for category '{category_name}'.")
+                logging.info(f"Theme inventory of category '{category_name}' refilled with {new_themes_added} new themes.")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while refilling themes for category '{category_name}': {e}")
+
+# Function to generate, enrich and save the article for one theme. The image search runs
+# in parallel with the LLM call; the content is enriched in memory and written once.
+def generate_article_for_theme(pool, theme):
+    theme_id, category_id, theme_title, keywords_str, description = theme
+    logging.info(f"Generating article for theme '{theme_title}' (ID: {theme_id}).")
+    keywords = [kw.strip() for kw in keywords_str.split(',')]
+
+    def search_image():
+        with pooled_connection(pool) as image_conn:
+            return get_image_url(theme_title, pixabay_api_key, image_conn)
+
+    def write_article():
+        # Use different prompts based on the category
+        if category_id == 20:  # My Personal Blog
+            prompts = create_personal_blog_prompt(theme_title, description, keywords)
+        else:
+            prompts = create_article_prompt(theme_title, description, keywords, theme_id, None)
 
-        # Fetch themes that need articles generated
-        themes = get_themes_to_generate_articles(conn)
+        # Request to API to generate article
+        status, final_content = generate_article(prompts, perplexity_api_key)
+        if status == 'invalid_structure':
+            logging.error(f"Unexpected structure in API response: {final_content}")
+            return None
+        if status != 'valid' or not final_content:
+            logging.error("Failed to generate article.")
+            return None
+        if not isinstance(final_content, str):
+            logging.error(f"Expected a string, but got {type(final_content)}: {final_content}")
+            return None
 
-        for theme in themes:
-            theme_id, category_id, theme_title, keywords_str, description = theme
-            logging.info(f"Generating article for theme '{theme_title}' (ID: {theme_id}).")
-            keywords = [kw.strip() for kw in keywords_str.split(',')]
+        post_data = extract_post_data(final_content)
+        if not (post_data and all(post_data.values())):
+            logging.error("Post data is incomplete or missing. Skipping saving to database.")
+            return None
+        # Keywords come from the text as the model wrote it, before links and images are added
+        post_data['keywords'] = extract_keywords(post_data['content'])
+        return post_data
 
-            # Use different prompts based on the category
-            if category_id == 20:  # My Personal Blog
-                prompts = create_personal_blog_prompt(theme_title, description, keywords)
-            else:
-                prompts = create_article_prompt(theme_title, description, keywords, theme_id, conn)
-
-            # Request to API to generate article
-            status, final_content = generate_article(prompts, perplexity_api_key_local)
-
-            if status == 'valid' and final_content:
-                if not isinstance(final_content, str):
-                    logging.error(f"Expected a string, but got {type(final_content)}: {final_content}")
-                    continue
-
-                post_data = extract_post_data(final_content)
-
-                if post_data and all(post_data.values()):
-                    # Save post and get its ID
-                    post_id = save_post_to_database(conn, post_data, category_id, theme_id)
-                    if not post_id:
-                        logging.error(f"Failed to save post '{post_data['title']}' to database. Skipping.")
-                        continue
-
-                    # Integrate images and save image info
-                    post_data['content'] = integrate_images_into_content(post_data['content'], theme_title, pixabay_api_key_local, conn, post_id)
-                    # Insert cross-links
-                    post_data['content'] = insert_cross_links(post_data['content'], conn, exclude_post_id=post_id)
-                    # Update post with new content
-                    cursor = conn.cursor()
-                    cursor.execute("UPDATE posts SET content = %s WHERE id = %s", (post_data['content'], post_id))
-                    conn.commit()
-                    logging.info(f"Updated post ID {post_id} with integrated images and cross-links.")
-                else:
-                    logging.error("Post data is incomplete or missing. Skipping saving to database.")
-            elif status == 'invalid_structure':
-                logging.error(f"Unexpected structure in API response: {final_content}")
-            else:
-                logging.error("Failed to generate article.")
+    try:
+        with pooled_connection(pool) as conn:
+            def enrich_and_save(post_data, image_url):
+                if post_data is None:
+                    return None
+                post_data['content'], images = integrate_images_into_content(post_data['content'], theme_title, image_url)
+                # Insert cross-links
+                post_data['content'] = insert_cross_links(post_data['content'], conn)
+                # Append related articles
+                post_data['content'] = append_related_articles(post_data['content'], post_data, conn)
+                post_id = save_post_to_database(conn, post_data, category_id, theme_id, images)
+                if not post_id:
+                    logging.error(f"Failed to save post '{post_data['title']}' to database. Skipping.")
+                return post_id
+
+            run_task_graph({
+                'image': (search_image, []),
+                'post_data': (write_article, []),
+                'post_id': (enrich_and_save, ['post_data', 'image'])
+            })
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while generating article for theme '{theme_title}': {e}")
+
+# Off-peak run: top up every category's theme inventory to the high watermark, no articles
+def refill_all_theme_inventories(pool):
+    with ThreadPoolExecutor(max_workers=pipeline_config['category_workers'], thread_name_prefix='category') as category_executor:
+        for category in get_categories():
+            category_executor.submit(refill_theme_inventory, pool, category, 'high')
 
+# Main function to orchestrate the script
+def main():
+    configure_logging()
+    logging.info("Script started.")
+
+    pool = create_connection_pool()
+    if not pool:
+        logging.error("Database connection failed. Exiting script.")
+        return
+
+    try:
+        if '--refill-themes' in sys.argv[1:]:
+            refill_all_theme_inventories(pool)
+            return
+
+        # Each category contributes up to required_themes of its oldest unused themes
+        categories = get_categories()
+        category_themes = {}
+        with pooled_connection(pool) as conn:
+            # The published catalog reads updated_at / wp_synced_at; without them the run stops here
+            # instead of writing every article without cross-links
+            ensure_sync_columns(conn)
+            image_search.ensure_images_columns(conn)
+            keyword_extractor.load_keyword_model(keyword_model, conn)
+            for category in categories:
+                required_themes = get_required_themes_for_category(conn, category['category_id'])
+                category_themes[category['category_id']] = (
+                    get_themes_to_generate_articles(conn, category['category_id'], required_themes), required_themes
+                )
+        pending_themes = [theme for themes, _ in category_themes.values() for theme in themes]
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch') as prefetch_executor, \
+                ThreadPoolExecutor(max_workers=pipeline_config['article_workers'], thread_name_prefix='article') as article_executor:
+            # Image lookups are warmed while the articles are being written
+            prefetch_executor.submit(image_search.prefetch_images, [theme[2] for theme in pending_themes],
+                                     pixabay_api_key, lambda: pooled_connection(pool))
+            article_futures = [article_executor.submit(generate_article_for_theme, pool, theme) for theme in pending_themes]
+
+            def submit_article(theme):
+                prefetch_executor.submit(image_search.prefetch_images, [theme[2]],
+                                         pixabay_api_key, lambda: pooled_connection(pool))
+                article_futures.append(article_executor.submit(generate_article_for_theme, pool, theme))
+
+            # Categories below the low watermark are refilled in the background; the articles
+            # above never wait for it. A category whose inventory ran short also gets articles
+            # from the first themes of its refill.
+            with ThreadPoolExecutor(max_workers=pipeline_config['category_workers'], thread_name_prefix='category') as category_executor:
+                for category in categories:
+                    themes, required_themes = category_themes[category['category_id']]
+                    if len(themes) < required_themes:
+                        logging.warning(f"Theme inventory of category '{category['category_name']}' has only {len(themes)} of {required_themes} themes.")
+                    category_executor.submit(refill_theme_inventory, pool, category, 'low',
+                                             len(themes), required_themes - len(themes), submit_article)
+
+        logging.info(f"Processed {len(article_futures)} article themes.")
+        llm.log_route_stats()
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
     finally:
-        if conn:
-            conn.close()
-            logging.info("Database connection closed.")
+        pool.closeall()
+        logging.info("Database connection pool closed.")
 
     logging.info("Script finished successfully.")
 
@@ -0,0 +1,79 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def pg_conn():
+    """
+    Подключение к тестовой базе TEST_DATABASE_URL с пустой схемой на каждый тест:
+    таблицы создаются в ней, и search_path указывает только на нее.
+    Без TEST_DATABASE_URL тесты с базой пропускаются.
+    """
+    dsn = os.getenv('TEST_DATABASE_URL')
+    if not dsn:
+        pytest.skip('TEST_DATABASE_URL не задан')
+    psycopg2 = pytest.importorskip('psycopg2')
+
+    conn = psycopg2.connect(dsn)
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    with conn.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}")
+        cursor.execute(f"SET search_path TO {schema}")
+    conn.commit()
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP SCHEMA {schema} CASCADE")
+    conn.commit()
+    conn.close()
+
+
+def create_posts_table(conn):
+    """Таблица posts с колонками, которые читают синхронизация и генераторы."""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE posts (
+                id serial PRIMARY KEY,
+                title text,
+                content text,
+                status text,
+                tags text,
+                pub_date timestamp,
+                scheduled_date timestamp,
+                category_id integer,
+                category_name text,
+                news_id integer,
+                seo_title text,
+                seo_metadesc text,
+                seo_focuskw text,
+                seo_slug text,
+                keywords text,
+                wp_post_id integer
+            )
+        """)
+    conn.commit()
+
+
+def record_statements(conn):
+    """Запоминает запросы, выполненные через курсоры conn после вызова. Возвращает список запросов."""
+    from psycopg2.extensions import cursor as base_cursor
+
+    statements = []
+
+    class RecordingCursor(base_cursor):
+        def execute(self, query, params=None):
+            statements.append(query)
+            return super().execute(query, params)
+
+    conn.cursor_factory = RecordingCursor
+    return statements
+
+
+def ddl_statements(statements):
+    """DDL и массовые DELETE из записанных запросов: повторный запуск ensure_* не должен их выполнять."""
+    return [query for query in statements if query.split()[0].upper() in ('ALTER', 'CREATE', 'DROP', 'DELETE')]
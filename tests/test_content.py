@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip('mistune')
+
+from common.content import render_markdown
+
+
+def render(content, media=None):
+    media = media or {}
+    html, image_refs = render_markdown(content, media.get)
+    return html, image_refs
+
+
+def test_indented_html_blocks_are_not_rendered_as_code():
+    content = (
+        "Intro paragraph.\n"
+        "\n"
+        "    <div class=\"affiliate\">\n"
+        "        <a href=\"{{AFFILIATE_LINK:Racket}}\">Buy the racket</a>\n"
+        "    </div>\n"
+        "\n"
+        "\t<table>\n"
+        "\t    <tr><td>Weight</td><td>300 g</td></tr>\n"
+        "\t</table>\n"
+    )
+    html, _ = render(content)
+    assert '<pre>' not in html
+    assert '<div class="affiliate">' in html
+    assert '<a href="{{AFFILIATE_LINK:Racket}}">Buy the racket</a>' in html
+    assert '<tr><td>Weight</td><td>300 g</td></tr>' in html
+
+
+def test_fenced_code_keeps_its_indentation():
+    content = "```\n    <div>example</div>\n```\n"
+    html, _ = render(content)
+    assert '<pre><code>    &lt;div&gt;example&lt;/div&gt;' in html
+
+
+def test_non_ascii_markdown_image_matches_its_decoded_url():
+    source = 'https://example.com/ракетка.jpg'
+    html, image_refs = render(f'![Ракетка]({source})', {source: 'https://miatennispro.com/wp-content/uploads/racket.webp'})
+    assert 'src="https://miatennispro.com/wp-content/uploads/racket.webp"' in html
+    assert image_refs == [source]
+
+
+def test_percent_encoded_image_url_is_matched_as_written():
+    source = 'https://example.com/caf%C3%A9.jpg'
+    html, image_refs = render(f'![Cafe]({source}) <img src="{source}">', {source: 'https://cdn.example/cafe.webp'})
+    assert html.count('https://cdn.example/cafe.webp') == 2
+    assert image_refs == [source, source]
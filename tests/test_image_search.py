@@ -0,0 +1,36 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from common import image_search
+from conftest import record_statements, ddl_statements
+
+
+def test_ensure_images_columns_dedupes_once_and_then_skips_ddl(pg_conn):
+    with pg_conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE images (
+                id serial PRIMARY KEY,
+                query text,
+                image_url text,
+                source text,
+                timestamp timestamp
+            )
+        """)
+        cursor.execute("ALTER TABLE images ADD COLUMN query_key text")
+        cursor.execute("""
+            INSERT INTO images (query, query_key, image_url) VALUES
+                ('tennis racket', 'racket tennis', 'https://a'),
+                ('Tennis Racket', 'racket tennis', 'https://a'),
+                ('tennis racket', 'racket tennis', 'https://b')
+        """)
+    pg_conn.commit()
+
+    image_search.ensure_images_columns(pg_conn)
+    with pg_conn.cursor() as cursor:
+        cursor.execute("SELECT image_url, use_count FROM images ORDER BY image_url")
+        assert cursor.fetchall() == [('https://a', 0), ('https://b', 0)]
+
+    statements = record_statements(pg_conn)
+    image_search.ensure_images_columns(pg_conn)
+    assert ddl_statements(statements) == []
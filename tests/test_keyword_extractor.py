@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from common import keyword_extractor
+from conftest import create_posts_table, record_statements, ddl_statements
+
+
+def keyword_df(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT term, df FROM keyword_df")
+        return dict(cursor.fetchall())
+
+
+def test_catch_up_counts_posts_committed_out_of_id_order(pg_conn):
+    create_posts_table(pg_conn)
+    model = keyword_extractor.create_keyword_model()
+    keyword_extractor.load_keyword_model(model, pg_conn)
+
+    with pg_conn.cursor() as cursor:
+        # Новость получила id 1, но закоммичена позже поста генератора с id 2
+        cursor.execute("INSERT INTO posts (id, content) VALUES (1, 'Clay court tennis news')")
+        terms = keyword_extractor.record_document(cursor, 'Grass court racket review', 2)
+        cursor.execute("INSERT INTO posts (id, content) VALUES (2, 'Grass court racket review')")
+        cursor.execute("UPDATE posts SET keyword_counted = TRUE WHERE id = 2")
+    pg_conn.commit()
+    keyword_extractor.apply_document(model, terms)
+
+    reloaded = keyword_extractor.create_keyword_model()
+    keyword_extractor.load_keyword_model(reloaded, pg_conn)
+    assert reloaded['documents'] == 2
+    assert reloaded['df']['court'] == 2
+    assert reloaded['df']['clay court'] == 1
+    assert keyword_df(pg_conn) == reloaded['df']
+
+    # Повторная загрузка ничего не учитывает дважды и не меняет схему posts
+    statements = record_statements(pg_conn)
+    again = keyword_extractor.create_keyword_model()
+    keyword_extractor.load_keyword_model(again, pg_conn)
+    assert again['documents'] == 2 and again['df'] == reloaded['df']
+    assert [query for query in ddl_statements(statements) if 'CREATE TABLE IF NOT EXISTS' not in query] == []
+
+
+def test_flag_migration_keeps_posts_counted_by_the_old_watermark(pg_conn):
+    create_posts_table(pg_conn)
+    with pg_conn.cursor() as cursor:
+        cursor.execute("INSERT INTO posts (id, content) VALUES (1, 'Clay court'), (2, 'Grass court'), (3, 'Hard court')")
+        cursor.execute("CREATE TABLE keyword_df (term text PRIMARY KEY, df integer NOT NULL)")
+        cursor.execute("INSERT INTO keyword_df VALUES ('court', 2), ('clay', 1), ('grass', 1), ('clay court', 1), ('grass court', 1)")
+        cursor.execute("""
+            CREATE TABLE keyword_corpus (
+                id boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+                documents integer NOT NULL,
+                last_post_id integer NOT NULL
+            )
+        """)
+        cursor.execute("INSERT INTO keyword_corpus VALUES (TRUE, 2, 2)")
+    pg_conn.commit()
+
+    model = keyword_extractor.create_keyword_model()
+    keyword_extractor.load_keyword_model(model, pg_conn)
+    assert model['documents'] == 3
+    assert model['df']['court'] == 3
+    assert model['df']['hard court'] == 1
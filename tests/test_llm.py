@@ -0,0 +1,212 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import llm
+
+MESSAGES = [{'role': 'user', 'content': 'ping'}]
+
+
+class StubServer:
+    """
+    Локальный chat/completions: задержка и статус каждого запроса задаются функцией
+    responder(номер запроса) -> (задержка в секундах, HTTP-статус).
+    """
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.calls = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with stub.lock:
+                    number = len(stub.calls)
+                    stub.calls.append(payload)
+                delay, status = stub.responder(number)
+                time.sleep(delay)
+                body = json.dumps({
+                    'choices': [{'message': {'content': f'reply {number}'}, 'finish_reason': 'stop'}],
+                    'usage': {'completion_tokens': 100}
+                }).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # Клиент уже закрыл соединение проигравшего запроса
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/chat/completions'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def sequence(*responses):
+    """Ответы по порядку; последний повторяется для всех следующих запросов."""
+    return lambda number: responses[min(number, len(responses) - 1)]
+
+
+@pytest.fixture
+def stub_servers():
+    servers = []
+
+    def start(responder):
+        server = StubServer(responder)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture(autouse=True)
+def isolated_llm(tmp_path, monkeypatch):
+    monkeypatch.setitem(llm.llm_config, 'stats_path', str(tmp_path / 'llm_stats.json'))
+    monkeypatch.setitem(llm.llm_config, 'hedge_min_delay', 0.1)
+    monkeypatch.setitem(llm.llm_config, 'fallback_url', None)
+    monkeypatch.setitem(llm.llm_config, 'fallback_model', None)
+    monkeypatch.setitem(llm.llm_config, 'fallback_api_key', None)
+    monkeypatch.setitem(llm.llm_routes['theme_ideas'], 'latency_budget', 0.2)
+    monkeypatch.setattr(llm, 'llm_stats_loaded', False)
+    llm.llm_stats.clear()
+    llm.llm_pending.clear()
+    llm.provider_state.update(errors=0, down_until=0.0)
+    yield
+    llm.llm_stats.clear()
+    llm.llm_pending.clear()
+    llm.provider_state.update(errors=0, down_until=0.0)
+
+
+def test_fast_response_sends_no_hedge(stub_servers):
+    server = stub_servers(sequence((0.0, 200)))
+    response, latency = llm.hedged_post(server.url, {}, {'messages': MESSAGES}, delay=0.3)
+    assert response.status_code == 200
+    assert len(server.calls) == 1
+    assert latency < 0.3
+
+
+def test_hedge_fires_after_delay_and_first_200_wins(stub_servers):
+    server = stub_servers(sequence((1.5, 200), (0.0, 200)))
+    started_at = time.monotonic()
+    response, latency = llm.hedged_post(server.url, {}, {'messages': MESSAGES}, delay=0.2)
+    elapsed = time.monotonic() - started_at
+
+    assert len(server.calls) == 2
+    assert response.json()['choices'][0]['message']['content'] == 'reply 1'
+    assert 0.2 <= elapsed < 1.0
+    # Задержка считается от первой отправки, а не от отправки дубликата
+    assert latency >= 0.2
+
+
+def test_503_then_200_returns_the_200(stub_servers):
+    server = stub_servers(sequence((0.4, 503), (0.3, 200)))
+    response, _ = llm.hedged_post(server.url, {}, {'messages': MESSAGES}, delay=0.1)
+    assert response.status_code == 200
+    assert response.json()['choices'][0]['message']['content'] == 'reply 1'
+
+
+def test_all_errors_return_last_error_response(stub_servers):
+    server = stub_servers(sequence((0.0, 503)))
+    response, _ = llm.hedged_post(server.url, {}, {'messages': MESSAGES}, delay=0.3)
+    assert response.status_code == 503
+    assert len(server.calls) == 1
+
+
+def test_hedging_cuts_injected_latency_tail(stub_servers):
+    # Четные запросы с вероятностью 0.4 попадают в хвост в 2 с, остальные отвечают за 20-60 мс.
+    # Запросы идут последовательно, дубликат получает следующий (нечетный) номер и в хвост не попадает
+    rng = random.Random(7)
+    tail = [number % 2 == 0 and rng.random() < 0.4 for number in range(40)]
+    assert any(tail)
+    server = stub_servers(lambda number: (2.0 if tail[number] else rng.uniform(0.02, 0.06), 200))
+
+    elapsed = []
+    for _ in range(15):
+        started_at = time.monotonic()
+        response, _ = llm.hedged_post(server.url, {}, {'messages': MESSAGES}, delay=0.15)
+        elapsed.append(time.monotonic() - started_at)
+        assert response.status_code == 200
+    assert max(elapsed) < 1.0
+
+
+def test_chat_completion_records_stats_and_resets_errors(stub_servers, monkeypatch):
+    server = stub_servers(sequence((0.0, 503), (0.0, 200)))
+    monkeypatch.setitem(llm.llm_config, 'api_url', server.url)
+
+    assert llm.chat_completion('theme_ideas', 'key', MESSAGES).status_code == 503
+    assert llm.provider_state['errors'] == 1
+    assert llm.chat_completion('theme_ideas', 'key', MESSAGES).status_code == 200
+    assert llm.provider_state['errors'] == 0
+
+    with open(llm.llm_config['stats_path'], encoding='utf-8') as f:
+        stats = json.load(f)
+    model = llm.llm_routes['theme_ideas']['models'][0]
+    assert stats['theme_ideas'][model]['tokens'] == [100]
+
+
+def test_failover_after_repeated_errors(stub_servers, monkeypatch):
+    primary = stub_servers(sequence((0.0, 503)))
+    fallback = stub_servers(sequence((0.0, 200)))
+    monkeypatch.setitem(llm.llm_config, 'api_url', primary.url)
+    monkeypatch.setitem(llm.llm_config, 'fallback_url', fallback.url)
+    monkeypatch.setitem(llm.llm_config, 'fallback_model', 'fallback-model')
+    monkeypatch.setitem(llm.llm_config, 'fallback_api_key', 'fallback-key')
+
+    statuses = [
+        llm.chat_completion('theme_ideas', 'key', MESSAGES, temperature=0.7, search_domain_filter=['x']).status_code
+        for _ in range(llm.llm_config['failover_after'] + 2)
+    ]
+
+    assert statuses == [503] * (llm.llm_config['failover_after'] - 1) + [200] * 3
+    assert len(primary.calls) == llm.llm_config['failover_after']
+    assert len(fallback.calls) == 3
+    # Резервному endpoint уходят только совместимые параметры и его модель
+    assert fallback.calls[0]['model'] == 'fallback-model'
+    assert fallback.calls[0]['temperature'] == 0.7
+    assert 'search_domain_filter' not in fallback.calls[0]
+
+
+def test_no_failover_without_fallback_endpoint(stub_servers, monkeypatch):
+    primary = stub_servers(sequence((0.0, 503)))
+    monkeypatch.setitem(llm.llm_config, 'api_url', primary.url)
+    for _ in range(llm.llm_config['failover_after'] + 1):
+        assert llm.chat_completion('theme_ideas', 'key', MESSAGES).status_code == 503
+    assert len(primary.calls) == llm.llm_config['failover_after'] + 1
+
+
+def test_losing_request_does_not_delay_process_exit(stub_servers):
+    server = stub_servers(sequence((10.0, 200), (0.0, 200)))
+    script = (
+        "import sys; sys.path.insert(0, sys.argv[1]);"
+        "from common import llm;"
+        "response, _ = llm.hedged_post(sys.argv[2], {}, {}, delay=0.1);"
+        "print(response.status_code)"
+    )
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started_at = time.monotonic()
+    result = subprocess.run([sys.executable, '-c', script, repo_root, server.url],
+                            capture_output=True, text=True, timeout=30)
+    assert result.stdout.strip() == '200', result.stderr
+    assert time.monotonic() - started_at < 5
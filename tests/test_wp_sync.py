@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip('psycopg2')
+
+from common import wp_sync
+from conftest import create_posts_table, record_statements, ddl_statements
+
+
+def explain(conn, query, params):
+    with conn.cursor() as cursor:
+        cursor.execute('EXPLAIN ' + query, params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def test_changed_posts_query_uses_partial_index(pg_conn):
+    create_posts_table(pg_conn)
+    wp_sync.ensure_sync_columns(pg_conn)
+    with pg_conn.cursor() as cursor:
+        # Большой архив уже синхронизированных постов и несколько измененных после синхронизации
+        cursor.execute("""
+            INSERT INTO posts (title, content, status, category_id, wp_post_id, updated_at, wp_synced_at)
+            SELECT 'title ' || n, 'content', 'publish', 1 + n % 10, n,
+                   NOW() - interval '2 days', NOW() - interval '1 day'
+            FROM generate_series(1, 20000) AS n
+        """)
+        cursor.execute("UPDATE posts SET title = title || ' edited' WHERE id % 2000 = 0")
+        cursor.execute("ANALYZE posts")
+    pg_conn.commit()
+
+    site = wp_sync.create_site(wp_sync.wp_config)
+    plan = explain(pg_conn, *wp_sync.changed_posts_query(site, wp_sync.sync_profiles['blog']))
+    assert 'posts_publish_unsynced_idx' in plan, plan
+
+    with pg_conn.cursor() as cursor:
+        cursor.execute(*wp_sync.changed_posts_query(site, wp_sync.sync_profiles['blog']))
+        assert [row[0] for row in cursor.fetchall()] == list(range(2000, 20001, 2000))
+
+
+def test_ensure_sync_columns_skips_ddl_when_schema_is_current(pg_conn):
+    create_posts_table(pg_conn)
+    wp_sync.ensure_sync_columns(pg_conn)
+
+    statements = record_statements(pg_conn)
+    wp_sync.ensure_sync_columns(pg_conn)
+    assert ddl_statements(statements) == []
+
+
+def sister_site(min_post_id=0, categories=None):
+    return wp_sync.create_site(wp_sync.make_wp_config(
+        'sister.example', 'user', 'password', '/tmp/token.json', min_post_id=min_post_id, category_map=categories
+    ))
+
+
+def test_sister_site_links_point_to_its_own_domain_only_for_posts_it_has(pg_conn):
+    create_posts_table(pg_conn)
+    wp_sync.ensure_site_status_table(pg_conn)
+    with pg_conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO posts (id, status, seo_slug) VALUES
+                (1, 'publish', 'old-post'), (2, 'publish', 'synced-post'), (3, 'publish', 'queued-post')
+        """)
+        cursor.execute("INSERT INTO post_site_status (post_id, site, status) VALUES (2, 'sister.example', 'publish')")
+    pg_conn.commit()
+
+    content = (
+        '<a href="https://miatennispro.com/old-post/">old</a> '
+        '<a href="https://miatennispro.com/synced-post/">synced</a> '
+        '<a href="https://www.miatennispro.com/queued-post">queued</a> '
+        '<a href="https://miatennispro.com/category/news/">category</a> '
+        '<img src="https://miatennispro.com/wp-content/uploads/a.webp">'
+    )
+    rewritten = wp_sync.rewrite_site_links(sister_site(min_post_id=2), pg_conn, content)
+    assert rewritten == (
+        '<a href="https://miatennispro.com/old-post/">old</a> '
+        '<a href="https://sister.example/synced-post/">synced</a> '
+        '<a href="https://sister.example/queued-post/">queued</a> '
+        '<a href="https://miatennispro.com/category/news/">category</a> '
+        '<img src="https://miatennispro.com/wp-content/uploads/a.webp">'
+    )
+    assert wp_sync.rewrite_site_links(wp_sync.create_site(wp_sync.wp_config), pg_conn, content) == content
+
+
+def test_categories_are_mapped_per_site():
+    assert wp_sync.resolve_category_ids(wp_sync.create_site(wp_sync.wp_config), 20) == [20]
+    site = sister_site(categories={20: 4})
+    assert wp_sync.resolve_category_ids(site, 20) == [4]
+    assert wp_sync.resolve_category_ids(site, 8) == []